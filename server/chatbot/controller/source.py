@@ -1,7 +1,8 @@
 from logging import getLogger
-from typing import Annotated, Optional
+from typing import Annotated, Callable, Optional
 from uuid import UUID
-from fastapi import APIRouter, Depends, status, UploadFile
+from fastapi import APIRouter, Depends, Request, Response, status, UploadFile
+from fastapi.routing import APIRoute
 from fastapi_pagination import Page
 from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,14 +11,43 @@ from chatbot.db.model import SourceType, SourceStatus, Source
 from chatbot.dto import SourceResult, SourceCreate, SourceUpdate, SourceConfiguration
 from chatbot.service import source as service
 from chatbot.util.error import NotFoundError, BadRequestError
-from chatbot.task import enqueue, index_source
-from chatbot.service.source.upload import ALLOWED_FILE_EXTENSIONS
+from chatbot.task import enqueue, index_source, delete_source_documents
+from chatbot.service.source.upload import ALLOWED_FILE_EXTENSIONS, MAX_UPLOAD_SIZE
+
+# multipart boundaries and part headers sent along with an uploaded file
+UPLOAD_BODY_OVERHEAD = 64 * 1024
 
 logger = getLogger(__name__)
 
+
+class SourceRoute(APIRoute):
+    """Source route, rejecting bodies larger than an upload before they are received
+
+    The declared length is checked only, save_file caps the bytes actually read
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler: Callable = super().get_route_handler()
+
+        async def check_content_length(request: Request) -> Response:
+            content_length: Optional[str] = request.headers.get("content-length")
+
+            if (
+                content_length is not None
+                and content_length.isdigit()
+                and int(content_length) > MAX_UPLOAD_SIZE + UPLOAD_BODY_OVERHEAD
+            ):
+                raise BadRequestError("File is too large")
+
+            return await handler(request)
+
+        return check_content_length
+
+
 router = APIRouter(
     prefix="/source",
     tags=["source"],
+    route_class=SourceRoute,
     dependencies=[],
     responses={status.HTTP_404_NOT_FOUND: {"description": "Not found"}},
 )
@@ -106,14 +136,43 @@ async def upload_file(
     if source.type != SourceType.UPLOAD:
         raise BadRequestError("Invalid source type")
 
-    if source.status != SourceStatus.NEW:
+    # a new file of an indexed source replaces its documents incrementally
+    if source.status not in (
+        SourceStatus.NEW,
+        SourceStatus.FINISHED,
+        SourceStatus.ERROR,
+    ):
         raise BadRequestError("Invalid source status")
 
     if upload.filename.split(".")[-1] not in ALLOWED_FILE_EXTENSIONS:
         raise BadRequestError("Invalid file type")
 
-    source = await service.upload(db, source, upload)
-    await enqueue(index_source, source_id=str(source.id))
+    # bodies declaring a larger length are rejected by SourceRoute before this
+    if upload.size is not None and upload.size > MAX_UPLOAD_SIZE:
+        raise BadRequestError("File is too large")
+
+    previous_file_hash: Optional[str] = (
+        source.progress.file_hash if source.progress is not None else None
+    )
+
+    try:
+        source = await service.upload(db, source, upload)
+    except ValueError as exc:
+        raise BadRequestError(str(exc)) from exc
+
+    # a new source already has indexing enqueued, a failed one is indexed again
+    if (
+        source.progress.file_hash == previous_file_hash
+        and source.status != SourceStatus.ERROR
+    ):
+        logger.info("upload_file, identical file, indexing skipped")
+        return source
+
+    await enqueue(
+        index_source,
+        source_id=str(source.id),
+        reindex=source.status != SourceStatus.NEW,
+    )
 
     return source
 
@@ -123,6 +182,7 @@ async def delete(db: Annotated[AsyncSession, Depends(get_db)], item_id: UUID):
     """Delete source by id"""
     logger.debug("delete, item_id=%s", item_id)
     await service.delete(db, item_id)
+    await enqueue(delete_source_documents, source_id=str(item_id))
 
 
 @router.post("/{item_id}/reindex", status_code=status.HTTP_204_NO_CONTENT)
@@ -50,9 +50,11 @@ class Source(Base):
 
     @hybrid_property
     def can_be_reindexed(self) -> bool:
-        """Check if source can be reindexed"""
-        return self.type != SourceType.UPLOAD and self.status in (
-            SourceStatus.FINISHED, SourceStatus.ERROR, SourceStatus.NEW)
+        """Check if source can be reindexed, upload sources need an uploaded file"""
+        return self.status in (
+            SourceStatus.FINISHED, SourceStatus.ERROR, SourceStatus.NEW) and (
+            self.type != SourceType.UPLOAD
+            or (self.progress is not None and self.progress.file_hash is not None))
 
     def __repr__(self) -> str:
         return f"Source(id={self.id}, title={self.title}, type={self.type})"
@@ -68,6 +70,8 @@ class SourceProgress(Base):
     document_count: Mapped[int] = mapped_column(nullable=False, default=0)
     indexed_count: Mapped[int] = mapped_column(nullable=False, default=0)
     temporary_file_path: Mapped[str] = mapped_column(nullable=True)
+    # sha256 of the uploaded file
+    file_hash: Mapped[str] = mapped_column(nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(
         nullable=False, default=datetime.utcnow)
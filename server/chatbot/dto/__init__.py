@@ -5,6 +5,7 @@ from .source import (
     SourceUpdate,
     SourceResult,
     SourceConfiguration,
+    UploadConfiguration,
     JiraConfiguration,
     ConfluenceConfiguration,
 )
@@ -35,6 +36,7 @@ __all__ = [
     "SourceUpdate",
     "SourceResult",
     "SourceConfiguration",
+    "UploadConfiguration",
     "JiraConfiguration",
     "ConfluenceConfiguration",
     "ConfigurationResult",
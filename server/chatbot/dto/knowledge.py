@@ -11,6 +11,7 @@ class KnowledgeResult(BaseModel):
     title: str
     subtitle: Optional[str]
     url: Optional[str]
+    part: Optional[int]
     chunk: Optional[int]
     total_chunks: Optional[int]
     text: Optional[str]
@@ -29,6 +30,8 @@ class KnowledgeDocument(BaseModel):
     type: str
     subtitle: Optional[str]
     url: Optional[str]
+    # index of the part when a single file section is split into several documents
+    part: Optional[int]
     text: str
 
     def __repr__(self) -> str:
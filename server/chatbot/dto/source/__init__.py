@@ -1,5 +1,10 @@
 from .source import SourceCreate, SourceUpdate, SourceResult, SourceProgressResult
-from .configuration import SourceConfiguration, ConfluenceConfiguration, JiraConfiguration
+from .configuration import (
+    SourceConfiguration,
+    UploadConfiguration,
+    ConfluenceConfiguration,
+    JiraConfiguration,
+)
 
 __all__ = [
     "SourceCreate",
@@ -7,6 +12,7 @@ __all__ = [
     "SourceResult",
     "SourceProgressResult",
     "SourceConfiguration",
+    "UploadConfiguration",
     "ConfluenceConfiguration",
     "JiraConfiguration",
 ]
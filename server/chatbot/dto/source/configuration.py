@@ -6,16 +6,24 @@ from pydantic import BaseModel
 class SourceConfiguration(BaseModel):
     """Base source configuration"""
 
+    # chunk and overlap budgets in embedding model tokens, model defaults if not set
+    chunk_size: Optional[int]
+    chunk_overlap: Optional[int]
+
     def dict(self, *args, **kwargs):
         """Get dictionary representation"""
         result: dict = super().dict(*args, **kwargs)
 
         for k, v in result.items():
-            result[k] = str(v)
+            result[k] = str(v) if v is not None else None
 
         return result
 
 
+class UploadConfiguration(SourceConfiguration):
+    """Upload configuration"""
+
+
 class ConfluenceConfiguration(SourceConfiguration):
     """Confluence configuration"""
 
@@ -1,4 +1,5 @@
 from .connection import Connection
 from .collection import DocumentCollection, get_collection
+from .writer import DocumentWriter
 
-__all__ = ["Connection", "DocumentCollection", "get_collection"]
+__all__ = ["Connection", "DocumentCollection", "DocumentWriter", "get_collection"]
@@ -1,7 +1,7 @@
 from logging import getLogger
+from os import environ
 from typing import List, Optional, AsyncIterator
 
-from chromadb import Collection, ClientAPI
 from chromadb.api.types import (
     OneOrMany,
     Embedding,
@@ -14,40 +14,66 @@ from chromadb.api.types import (
 )
 
 from chatbot.dto.knowledge import KnowledgeResult
-from chatbot.util.aio import make_async
 from chatbot.util.singleton import singleton
-from .connection import Connection
+from .lexical import LEXICAL_INDEX, LEXICAL_INDEX_PATH, LexicalIndex
+from .store import BaseVectorStore, get_vector_store
 
-COLLECTION_NAME = "stack_document_collection"
 VECTOR_DIMENSIONS = 768
 COSINE_DISTANCE_LIMIT = 0.25
+DELETE_BATCH_SIZE = int(environ.get("DELETE_BATCH_SIZE", "5000"))
+# number of lexical and vector results fused in hybrid queries, at least n_results
+HYBRID_CANDIDATES = int(environ.get("HYBRID_CANDIDATES", "50"))
+# reciprocal rank fusion constant, higher values flatten the rank weights
+RRF_K = int(environ.get("RRF_K", "60"))
 
 logger = getLogger(__name__)
 
 
-# TODO: fix async, as @make_async wraps everything in new event loop
 @singleton
 class DocumentCollection:
-    """Chroma document collection"""
+    """Document collection, backed by the configured vector store"""
 
     def __init__(self):
         """Constructor"""
         logger.debug("__init__")
 
-        self.client: Optional[ClientAPI] = Connection().client
-        self.collection: Optional[Collection] = None
+        self.store: BaseVectorStore = get_vector_store(VECTOR_DIMENSIONS)
+        self.lexical: Optional[LexicalIndex] = (
+            LexicalIndex(LEXICAL_INDEX_PATH) if LEXICAL_INDEX else None
+        )
         self.create()
 
     def create(self):
         """Create collection"""
         logger.debug("create")
+        self.store.create()
 
-        self.collection = self.client.get_or_create_collection(
-            name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"}
-        )
+    def close(self):
+        """Close collection"""
+        logger.debug("close")
+        self.store.close()
+
+        if self.lexical is not None:
+            self.lexical.close()
+
+    @staticmethod
+    def _to_many(embeddings: OneOrMany[Embedding]) -> list[Embedding]:
+        # a single embedding is a flat list of numbers, stores take a list of them
+        if len(embeddings) > 0 and isinstance(embeddings[0], (int, float)):
+            return [embeddings]
+
+        return embeddings
 
-    @make_async
-    def query_embeddings(
+    @staticmethod
+    def _to_results(
+        ids: IDs, metadatas: List[Metadata], documents: List[Document]
+    ) -> List[KnowledgeResult]:
+        return [
+            KnowledgeResult(id=id, text=document, **metadata)
+            for id, metadata, document in zip(ids, metadatas, documents)
+        ]
+
+    async def query_embeddings(
         self,
         query_embeddings: Optional[OneOrMany[Embedding]],
         n_results: int,
@@ -60,10 +86,8 @@ class DocumentCollection:
             n_results,
             metadata_filter,
         )
-        query_result: QueryResult = self.collection.query(
-            query_embeddings=query_embeddings,
-            n_results=n_results,
-            where=metadata_filter,
+        query_result: QueryResult = await self.store.query(
+            self._to_many(query_embeddings), n_results, metadata_filter
         )
         logger.debug("query_embeddings, query_result=%s", query_result)
         result: List[KnowledgeResult] = []
@@ -86,14 +110,148 @@ class DocumentCollection:
 
         return result
 
-    @make_async
-    def delete(self, ids: IDs):
+    async def query_text(
+        self, query: str, n_results: int, metadata_filter: Optional[dict] = None
+    ) -> List[KnowledgeResult]:
+        """Query lexical index, best BM25 score first"""
+        logger.debug(
+            "query_text, query=%s, n_results=%s, metadata_filter=%s",
+            query,
+            n_results,
+            metadata_filter,
+        )
+
+        if self.lexical is None:
+            return []
+
+        ids: IDs = await self.lexical.query(query, n_results)
+
+        if len(ids) == 0:
+            return []
+
+        get_result: GetResult = await self.store.get(
+            ids=ids, where=metadata_filter, include=["documents", "metadatas"]
+        )
+        results: dict[ID, KnowledgeResult] = {
+            result.id: result
+            for result in self._to_results(
+                get_result["ids"], get_result["metadatas"], get_result["documents"]
+            )
+        }
+
+        return [results[id] for id in ids if id in results]
+
+    async def query_hybrid(
+        self,
+        query: str,
+        query_embeddings: Optional[OneOrMany[Embedding]],
+        n_results: int,
+        metadata_filter: Optional[dict] = None,
+    ) -> List[KnowledgeResult]:
+        """Query lexical index and collection with embeddings, fusing both rankings
+
+        Results are ordered by reciprocal rank fusion, lexical matches are kept
+        regardless of the cosine distance limit
+        """
+        logger.debug(
+            "query_hybrid, query=%s, n_results=%s, metadata_filter=%s",
+            query,
+            n_results,
+            metadata_filter,
+        )
+        candidates: int = max(n_results, HYBRID_CANDIDATES)
+        lexical_results: List[KnowledgeResult] = await self.query_text(
+            query, candidates, metadata_filter
+        )
+        query_result: QueryResult = await self.store.query(
+            self._to_many(query_embeddings), candidates, metadata_filter
+        )
+        vector_results: List[KnowledgeResult] = self._to_results(
+            query_result["ids"][0],
+            query_result["metadatas"][0],
+            query_result["documents"][0],
+        )
+
+        scores: dict[ID, float] = {}
+        results: dict[ID, KnowledgeResult] = {}
+
+        for ranking in (lexical_results, vector_results):
+            for rank, result in enumerate(ranking):
+                scores[result.id] = scores.get(result.id, 0) + 1 / (RRF_K + rank + 1)
+                results[result.id] = result
+
+        lexical_ids: set[ID] = {result.id for result in lexical_results}
+        distant_ids: set[ID] = {
+            id
+            for id, distance in zip(
+                query_result["ids"][0], query_result["distances"][0]
+            )
+            if distance > COSINE_DISTANCE_LIMIT and id not in lexical_ids
+        }
+        ids: List[ID] = sorted(
+            (id for id in scores if id not in distant_ids),
+            key=lambda id: scores[id],
+            reverse=True,
+        )
+        logger.debug(
+            "query_hybrid, lexical=%s, vector=%s, distant=%s",
+            len(lexical_results),
+            len(vector_results),
+            len(distant_ids),
+        )
+
+        return [results[id] for id in ids[:n_results]]
+
+    async def delete(self, ids: IDs):
         """Delete document"""
         logger.debug("delete, ids=%s", ids)
-        return self.collection.delete(ids)
+        await self.store.delete(ids)
+
+        if self.lexical is not None:
+            await self.lexical.delete(ids)
+
+    async def delete_by_source(
+        self, source_id: str, batch_size: int = DELETE_BATCH_SIZE
+    ) -> int:
+        """Delete all documents of source in batches, returns number of documents"""
+        logger.debug("delete_by_source, source_id=%s", source_id)
+        deleted: int = 0
+
+        while True:
+            ids: IDs = (
+                await self.store.get(where={"source_id": source_id}, limit=batch_size)
+            )["ids"]
+
+            if len(ids) == 0:
+                break
+
+            await self.delete(ids)
+            deleted += len(ids)
+
+        logger.debug("delete_by_source, source_id=%s, deleted=%s", source_id, deleted)
 
-    @make_async
-    def upsert(
+        return deleted
+
+    async def get_source_ids(self, batch_size: int = DELETE_BATCH_SIZE) -> set[str]:
+        """Get ids of all sources that have documents in collection"""
+        logger.debug("get_source_ids")
+        source_ids: set[str] = set()
+        offset: int = 0
+
+        while True:
+            metadatas: list[Metadata] = (
+                await self.store.get(
+                    limit=batch_size, offset=offset, include=["metadatas"]
+                )
+            )["metadatas"]
+            source_ids |= {metadata["source_id"] for metadata in metadatas}
+
+            if len(metadatas) < batch_size:
+                return source_ids
+
+            offset += batch_size
+
+    async def upsert(
         self,
         ids: OneOrMany[ID],
         embeddings: Optional[OneOrMany[Embedding]] = None,
@@ -103,15 +261,19 @@ class DocumentCollection:
         """Insert/update document"""
         logger.debug(
             "upsert, ids=%s, embeddings=%s, metadatas=%s, documents=%s",
-            ids,
+            len(ids),
             len(embeddings),
             len(metadatas),
             len(documents),
         )
-        return self.collection.upsert(ids, embeddings, metadatas, documents)
+        await self.store.upsert(ids, embeddings, metadatas, documents)
 
-    @make_async
-    def search(
+        if self.lexical is not None:
+            await self.lexical.upsert(
+                ids, [metadata.get("title") or "" for metadata in metadatas], documents
+            )
+
+    async def search(
         self,
         ids: Optional[OneOrMany[ID]] = None,
         limit: Optional[int] = None,
@@ -120,7 +282,7 @@ class DocumentCollection:
         """Search collection"""
         logger.debug("search, ids=%s, limit=%s, offset=%s", ids, limit, offset)
 
-        search_result: GetResult = self.collection.get(
+        search_result: GetResult = await self.store.get(
             ids=ids, limit=limit, offset=offset, include=["documents", "metadatas"]
         )
         result: List[KnowledgeResult] = []
@@ -139,19 +301,75 @@ class DocumentCollection:
 
         return result
 
-    @make_async
-    def count(self) -> int:
+    async def get_metadatas(
+        self,
+        metadata_filter: dict,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> dict[ID, Metadata]:
+        """Get metadata of documents matching the filter by id"""
+        logger.debug(
+            "get_metadatas, metadata_filter=%s, limit=%s, offset=%s",
+            metadata_filter,
+            limit,
+            offset,
+        )
+
+        get_result: GetResult = await self.store.get(
+            where=metadata_filter, limit=limit, offset=offset, include=["metadatas"]
+        )
+
+        return dict(zip(get_result["ids"], get_result["metadatas"]))
+
+    async def get_embeddings(self, ids: IDs) -> dict[ID, Embedding]:
+        """Get stored embeddings of documents by id, missing ones are left out"""
+        logger.debug("get_embeddings, ids=%s", len(ids))
+
+        get_result: GetResult = await self.store.get(ids=ids, include=["embeddings"])
+
+        return {
+            id: embedding
+            for id, embedding in zip(get_result["ids"], get_result["embeddings"])
+            if embedding is not None
+        }
+
+    async def count(self) -> int:
         """Get document count"""
         logger.debug("count")
-        return self.collection.count()
+        return await self.store.count()
 
-    @make_async
-    def drop(self):
+    async def drop(self):
         """Delete collection"""
         logger.debug("drop")
+        await self.store.drop()
 
-        self.client.delete_collection(COLLECTION_NAME)
-        self.create()
+        if self.lexical is not None:
+            await self.lexical.drop()
+
+    async def rebuild_lexical_index(self, batch_size: int = DELETE_BATCH_SIZE) -> int:
+        """Index all documents of collection in lexical index, returns their number"""
+        logger.debug("rebuild_lexical_index")
+
+        if self.lexical is None:
+            return 0
+
+        await self.lexical.drop()
+        offset: int = 0
+
+        while True:
+            get_result: GetResult = await self.store.get(
+                limit=batch_size, offset=offset, include=["documents", "metadatas"]
+            )
+            await self.lexical.upsert(
+                get_result["ids"],
+                [metadata.get("title") or "" for metadata in get_result["metadatas"]],
+                get_result["documents"],
+            )
+            offset += len(get_result["ids"])
+
+            if len(get_result["ids"]) < batch_size:
+                logger.info("rebuild_lexical_index, documents=%s", offset)
+                return offset
 
 
 async def get_collection() -> AsyncIterator[DocumentCollection]:
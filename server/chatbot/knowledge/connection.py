@@ -1,13 +1,48 @@
+import asyncio
+import random
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial, wraps
 from logging import getLogger
+from os import environ, getpid
 from typing import Optional
 
 from chromadb import HttpClient, ClientAPI, Settings
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
 
 from chatbot.config import CHROMA_HOST, CHROMA_PORT
 from chatbot.util.singleton import singleton
 
+# max number of requests to Chroma at once
+CHROMA_MAX_IN_FLIGHT = int(environ.get("CHROMA_MAX_IN_FLIGHT", "8"))
+# seconds to connect and between received bytes, 0 disables timeout
+CHROMA_TIMEOUT = float(environ.get("CHROMA_TIMEOUT", "60"))
+CHROMA_RETRIES = int(environ.get("CHROMA_RETRIES", "3"))
+# seconds, doubled on every retry
+CHROMA_RETRY_BACKOFF = float(environ.get("CHROMA_RETRY_BACKOFF", "0.5"))
+RETRY_ERRORS = (RequestsConnectionError, Timeout)
+
 logger = getLogger(__name__)
 
+_executor: Optional[Executor] = None
+_executor_pid: Optional[int] = None
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter applying a default timeout to requests sent without one"""
+
+    def __init__(self, timeout: float, *args, **kwargs):
+        """Constructor"""
+        super().__init__(*args, **kwargs)
+        self.timeout: float = timeout
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        return super().send(request, **kwargs)
+
 
 @singleton
 class Connection:
@@ -24,8 +59,79 @@ class Connection:
             CHROMA_HOST, CHROMA_PORT, settings=Settings(anonymized_telemetry=False)
         )
 
+        if CHROMA_TIMEOUT > 0:
+            self._set_timeout(CHROMA_TIMEOUT)
+
+    def _set_timeout(self, timeout: float):
+        """Set timeout of HTTP requests, Chroma client doesn't set any, so a stalled
+        server would block the calling thread forever"""
+        session: Optional[Session] = getattr(
+            getattr(self._client, "_server", None), "_session", None
+        )
+
+        if session is None:
+            logger.warning("_set_timeout, client has no HTTP session, timeout not set")
+            return
+
+        adapter: HTTPAdapter = TimeoutHTTPAdapter(timeout)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
     @property
     def client(self) -> ClientAPI:
         """Get client"""
         logger.debug("client")
         return self._client
+
+
+def get_executor() -> Executor:
+    """Get executor for Chroma requests, created once per process
+
+    Its size bounds the number of requests in flight, and Chroma calls don't compete
+    with other work in the default executor
+    """
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != getpid():
+        logger.info("get_executor, max_in_flight=%s", CHROMA_MAX_IN_FLIGHT)
+        _executor = ThreadPoolExecutor(
+            max_workers=CHROMA_MAX_IN_FLIGHT, thread_name_prefix="chroma"
+        )
+        _executor_pid = getpid()
+
+    return _executor
+
+
+def chroma_async(func):
+    """Async wrapper for Chroma calls, with retries with backoff
+
+    Calls time out in the HTTP client, so a timed out call frees its executor thread
+    """
+
+    @wraps(func)
+    async def run(*args, **kwargs):
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        for attempt in range(CHROMA_RETRIES + 1):
+            try:
+                return await loop.run_in_executor(
+                    get_executor(), partial(func, *args, **kwargs)
+                )
+
+            except RETRY_ERRORS as error:
+                if attempt >= CHROMA_RETRIES:
+                    raise
+
+                delay: float = (
+                    CHROMA_RETRY_BACKOFF * 2**attempt * random.uniform(1, 1.5)
+                )
+                logger.warning(
+                    "chroma_async, func=%s, attempt=%s, error=%r, retry in %.2fs",
+                    func.__name__,
+                    attempt + 1,
+                    error,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+
+    return run
@@ -0,0 +1,183 @@
+import re
+import sqlite3
+from logging import getLogger
+from os import environ, getpid, path
+from threading import Lock
+from typing import List, Optional
+
+from chromadb.api.types import ID, IDs
+
+from chatbot.util.aio import make_async
+
+LEXICAL_INDEX = environ.get("LEXICAL_INDEX", "false").lower() == "true"
+LEXICAL_INDEX_PATH = environ.get(
+    "LEXICAL_INDEX_PATH",
+    path.join(environ.get("FILE_STORAGE_PATH", "/tmp"), "lexical_index.db"),
+)
+# words, keeping part numbers, codes and paths like "AB-12.3/x" together
+TERM_PATTERN = re.compile(r"\w+(?:[-_.:/]\w+)*")
+MAX_VARIABLES = 900
+
+logger = getLogger(__name__)
+
+
+def get_match_query(query: str) -> Optional[str]:
+    """Get FTS5 query matching any term of a query, None if it has no terms"""
+    terms: List[str] = list(dict.fromkeys(TERM_PATTERN.findall(query.lower())))
+
+    if len(terms) == 0:
+        return None
+
+    # a quoted term is a phrase, so a code matches its parts in the same order
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class LexicalIndex:
+    """SQLite FTS5 inverted index over document titles and texts, ranked by BM25"""
+
+    def __init__(self, file_path: str):
+        """Constructor"""
+        logger.debug("__init__, file_path=%s", file_path)
+
+        self.file_path: str = file_path
+        self._lock: Lock = Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get or open connection, once per process"""
+        if self._connection is None or self._pid != getpid():
+            logger.info("_get_connection, opening %s", self.file_path)
+
+            self._connection = sqlite3.connect(
+                self.file_path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS document "
+                "(rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)"
+            )
+            self._connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5"
+                "(title, text, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            self._connection.commit()
+            self._pid = getpid()
+
+        return self._connection
+
+    def close(self):
+        """Close connection"""
+        with self._lock:
+            if self._connection is not None and self._pid == getpid():
+                self._connection.close()
+
+            self._connection = None
+
+    @make_async
+    def upsert(self, ids: IDs, titles: List[str], documents: List[str]):
+        """Insert/update documents"""
+        logger.debug("upsert, ids=%s", len(ids))
+
+        with self._lock:
+            connection: sqlite3.Connection = self._get_connection()
+
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO document (id) VALUES (?)",
+                    [(id,) for id in ids],
+                )
+                rowids: dict[ID, int] = self._get_rowids(connection, ids)
+                connection.executemany(
+                    "DELETE FROM document_text WHERE rowid = ?",
+                    [(rowids[id],) for id in ids],
+                )
+                connection.executemany(
+                    "INSERT INTO document_text (rowid, title, text) VALUES (?, ?, ?)",
+                    [
+                        (rowids[id], title, document)
+                        for id, title, document in zip(ids, titles, documents)
+                    ],
+                )
+
+    @make_async
+    def delete(self, ids: IDs):
+        """Delete documents"""
+        logger.debug("delete, ids=%s", len(ids))
+
+        with self._lock:
+            connection: sqlite3.Connection = self._get_connection()
+
+            with connection:
+                rowids: List[int] = list(self._get_rowids(connection, ids).values())
+                connection.executemany(
+                    "DELETE FROM document_text WHERE rowid = ?",
+                    [(rowid,) for rowid in rowids],
+                )
+                connection.executemany(
+                    "DELETE FROM document WHERE rowid = ?",
+                    [(rowid,) for rowid in rowids],
+                )
+
+    @make_async
+    def drop(self):
+        """Delete all documents"""
+        logger.debug("drop")
+
+        with self._lock:
+            connection: sqlite3.Connection = self._get_connection()
+
+            with connection:
+                connection.execute("DELETE FROM document_text")
+                connection.execute("DELETE FROM document")
+
+    @make_async
+    def count(self) -> int:
+        """Get document count"""
+        with self._lock:
+            return (
+                self._get_connection()
+                .execute("SELECT COUNT(*) FROM document")
+                .fetchone()[0]
+            )
+
+    @make_async
+    def query(self, query: str, n_results: int) -> List[ID]:
+        """Get ids of documents matching any query term, best BM25 score first"""
+        logger.debug("query, query=%s, n_results=%s", query, n_results)
+        match_query: Optional[str] = get_match_query(query)
+
+        if match_query is None:
+            return []
+
+        with self._lock:
+            rows: List[tuple[str]] = (
+                self._get_connection()
+                .execute(
+                    "SELECT document.id FROM document_text "
+                    "JOIN document ON document.rowid = document_text.rowid "
+                    "WHERE document_text MATCH ? "
+                    "ORDER BY bm25(document_text) LIMIT ?",
+                    (match_query, n_results),
+                )
+                .fetchall()
+            )
+
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _get_rowids(connection: sqlite3.Connection, ids: IDs) -> dict[ID, int]:
+        result: dict[ID, int] = {}
+
+        for start in range(0, len(ids), MAX_VARIABLES):
+            chunk: IDs = ids[start : start + MAX_VARIABLES]
+            result.update(
+                connection.execute(
+                    "SELECT id, rowid FROM document "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            )
+
+        return result
@@ -0,0 +1,25 @@
+from os import environ
+
+from .base import BaseVectorStore
+from .chroma import ChromaVectorStore
+from .hnsw import HnswVectorStore
+from .flat import NumpyVectorStore
+
+# chroma, hnsw or numpy
+VECTOR_STORE = environ.get("VECTOR_STORE", "chroma").lower()
+
+
+def get_vector_store(dimensions: int) -> BaseVectorStore:
+    """Get configured vector store"""
+    match VECTOR_STORE:
+        case "chroma":
+            return ChromaVectorStore()
+        case "hnsw":
+            return HnswVectorStore(dimensions=dimensions)
+        case "numpy":
+            return NumpyVectorStore(dimensions=dimensions)
+
+    raise ValueError(f"Unknown vector store: {VECTOR_STORE}")
+
+
+__all__ = ["BaseVectorStore", "VECTOR_STORE", "get_vector_store"]
@@ -0,0 +1,68 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from chromadb.api.types import (
+    Embedding,
+    Metadata,
+    Document,
+    ID,
+    IDs,
+    QueryResult,
+    GetResult,
+)
+
+
+class BaseVectorStore(ABC):
+    """Base vector store
+
+    Results follow the layout of Chroma query and get results, distances are cosine.
+    Metadata filters follow Chroma where syntax.
+    """
+
+    def create(self):
+        """Create storage if it doesn't exist"""
+
+    def close(self):
+        """Release resources"""
+
+    @abstractmethod
+    async def query(
+        self,
+        query_embeddings: list[Embedding],
+        n_results: int,
+        where: Optional[dict] = None,
+    ) -> QueryResult:
+        """Get nearest documents for every query embedding"""
+
+    @abstractmethod
+    async def get(
+        self,
+        ids: Optional[IDs] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[list[str]] = None,
+    ) -> GetResult:
+        """Get documents by ids or metadata filter"""
+
+    @abstractmethod
+    async def upsert(
+        self,
+        ids: list[ID],
+        embeddings: list[Embedding],
+        metadatas: list[Metadata],
+        documents: list[Document],
+    ):
+        """Insert/update documents"""
+
+    @abstractmethod
+    async def delete(self, ids: IDs):
+        """Delete documents"""
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Get document count"""
+
+    @abstractmethod
+    async def drop(self):
+        """Delete all documents"""
@@ -0,0 +1,86 @@
+from logging import getLogger
+from typing import Optional
+
+from chromadb import Collection, ClientAPI
+from chromadb.api.types import (
+    Embedding,
+    Metadata,
+    Document,
+    ID,
+    IDs,
+    QueryResult,
+    GetResult,
+)
+
+from ..connection import Connection, chroma_async
+from .base import BaseVectorStore
+
+COLLECTION_NAME = "stack_document_collection"
+
+logger = getLogger(__name__)
+
+
+class ChromaVectorStore(BaseVectorStore):
+    """Chroma server vector store"""
+
+    def __init__(self):
+        """Constructor"""
+        logger.debug("__init__")
+
+        self.client: Optional[ClientAPI] = Connection().client
+        self.collection: Optional[Collection] = None
+
+    def create(self):
+        """Create collection"""
+        logger.debug("create")
+
+        self.collection = self.client.get_or_create_collection(
+            name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"}
+        )
+
+    @chroma_async
+    def query(
+        self,
+        query_embeddings: list[Embedding],
+        n_results: int,
+        where: Optional[dict] = None,
+    ) -> QueryResult:
+        return self.collection.query(
+            query_embeddings=query_embeddings, n_results=n_results, where=where
+        )
+
+    @chroma_async
+    def get(
+        self,
+        ids: Optional[IDs] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[list[str]] = None,
+    ) -> GetResult:
+        return self.collection.get(
+            ids=ids, where=where, limit=limit, offset=offset, include=include or []
+        )
+
+    @chroma_async
+    def upsert(
+        self,
+        ids: list[ID],
+        embeddings: list[Embedding],
+        metadatas: list[Metadata],
+        documents: list[Document],
+    ):
+        return self.collection.upsert(ids, embeddings, metadatas, documents)
+
+    @chroma_async
+    def delete(self, ids: IDs):
+        return self.collection.delete(ids)
+
+    @chroma_async
+    def count(self) -> int:
+        return self.collection.count()
+
+    @chroma_async
+    def drop(self):
+        self.client.delete_collection(COLLECTION_NAME)
+        self.create()
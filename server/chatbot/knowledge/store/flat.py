@@ -0,0 +1,336 @@
+from logging import getLogger
+import os
+from os import environ, makedirs, path
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+from chromadb.api.types import (
+    Embedding,
+    Metadata,
+    Document,
+    ID,
+    IDs,
+    QueryResult,
+    GetResult,
+)
+
+from chatbot.util.aio import make_async
+from .base import BaseVectorStore
+from .hnsw import VECTOR_STORE_PATH
+from .metadata import MetadataTable
+
+# number of stored vectors multiplied at once during search
+SEARCH_BLOCK_SIZE = int(environ.get("NUMPY_SEARCH_BLOCK_SIZE", "16384"))
+
+logger = getLogger(__name__)
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """Embedded vector store with exact search over memory-mapped float16 vectors
+
+    Normalized vectors are stored in a flat file, the row of a document is defined by
+    its label in the SQLite metadata table. The file is only appended to or
+    overwritten in place, and mapped read-only for search, so processes share it
+    through the page cache. The table keeps a copy of every vector, missing rows of
+    the file are restored from it on start.
+    """
+
+    def __init__(self, directory: str = VECTOR_STORE_PATH, dimensions: int = 768):
+        """Constructor"""
+        logger.debug("__init__, directory=%s, dimensions=%s", directory, dimensions)
+
+        self.directory: str = directory
+        self.dimensions: int = dimensions
+        self._row_size: int = dimensions * np.dtype(np.float16).itemsize
+        self._lock: Lock = Lock()
+        self._table: Optional[MetadataTable] = None
+        self._vectors: np.ndarray = np.zeros((0, dimensions), dtype=np.float16)
+        # live[row] is True for stored documents, may be longer than vectors
+        self._live: np.ndarray = np.zeros(0, dtype=bool)
+        self._generation: int = 0
+
+    @property
+    def _vectors_path(self) -> str:
+        return path.join(self.directory, "vectors.f16")
+
+    def create(self):
+        """Open storage"""
+        with self._lock:
+            if self._table is not None:
+                return
+
+            makedirs(self.directory, exist_ok=True)
+            self._table = MetadataTable(path.join(self.directory, "numpy.db"))
+            self._restore()
+            self._sync()
+            logger.info(
+                "create, documents=%s, rows=%s",
+                self._table.count(),
+                self._vectors.shape[0],
+            )
+
+    def close(self):
+        """Close storage"""
+        with self._lock:
+            if self._table is not None:
+                self._table.close()
+                self._table = None
+
+    def _map(self):
+        """Map vectors file, if it has grown"""
+        rows: int = (
+            path.getsize(self._vectors_path) // self._row_size
+            if path.exists(self._vectors_path)
+            else 0
+        )
+
+        if rows != self._vectors.shape[0]:
+            self._vectors = (
+                np.memmap(
+                    self._vectors_path,
+                    dtype=np.float16,
+                    mode="r",
+                    shape=(rows, self.dimensions),
+                )
+                if rows > 0
+                else np.zeros((0, self.dimensions), dtype=np.float16)
+            )
+
+    def _set_live(self, labels: list[int], live: bool):
+        if len(labels) == 0:
+            return
+
+        rows: np.ndarray = np.asarray(labels, dtype=np.int64) - 1
+
+        if rows.max() >= len(self._live):
+            self._live = np.concatenate(
+                [self._live, np.zeros(rows.max() + 1 - len(self._live), dtype=bool)]
+            )
+
+        self._live[rows] = live
+
+    def _sync(self):
+        """Apply changes made after the loaded generation"""
+        self._map()
+
+        if self._table.generation == self._generation:
+            return
+
+        changed, deleted, generation = self._table.get_changes(
+            self._generation, with_embeddings=False
+        )
+        self._set_live(deleted, False)
+
+        for batch in changed:
+            self._set_live([label for label, _ in batch], True)
+        self._generation = generation
+
+    @staticmethod
+    def _to_vectors(embeddings: list[Embedding]) -> list[bytes]:
+        """Normalize embeddings and convert them to float16 rows"""
+        vectors: np.ndarray = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        return [vector.tobytes() for vector in vectors.astype(np.float16)]
+
+    def _write(self, labels: list[int], vectors: list[bytes]):
+        """Write vectors to their rows"""
+        fd: int = os.open(self._vectors_path, os.O_RDWR | os.O_CREAT)
+
+        try:
+            for label, vector in zip(labels, vectors):
+                os.pwrite(fd, vector, (label - 1) * self._row_size)
+        finally:
+            os.close(fd)
+
+    def _restore(self):
+        """Write vectors of documents beyond the end of the vectors file"""
+        rows: int = (
+            path.getsize(self._vectors_path) // self._row_size
+            if path.exists(self._vectors_path)
+            else 0
+        )
+        restored: int = 0
+
+        for batch in self._table.iter_embeddings(min_label=rows):
+            # rows written without a copy in the table can't be restored
+            batch = [(label, vector) for label, vector in batch if len(vector) > 0]
+            self._write([label for label, _ in batch], [vector for _, vector in batch])
+            restored += len(batch)
+
+        if restored > 0:
+            logger.warning("_restore, restored vectors=%s", restored)
+
+    def _search(
+        self, queries: np.ndarray, n_results: int, mask: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get top rows and similarities for every query"""
+        best_rows: np.ndarray = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores: np.ndarray = np.zeros((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, len(mask), SEARCH_BLOCK_SIZE):
+            block_mask: np.ndarray = mask[start : start + SEARCH_BLOCK_SIZE]
+
+            if not block_mask.any():
+                continue
+
+            block: np.ndarray = self._vectors[start : start + len(block_mask)]
+            scores: np.ndarray = queries @ block.astype(np.float32).T
+            scores[:, ~block_mask] = -np.inf
+
+            rows: np.ndarray = np.concatenate(
+                [
+                    best_rows,
+                    np.broadcast_to(
+                        np.arange(start, start + len(block_mask)), scores.shape
+                    ),
+                ],
+                axis=1,
+            )
+            scores = np.concatenate([best_scores, scores], axis=1)
+            k: int = min(n_results, scores.shape[1])
+            top: np.ndarray = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(rows, top, axis=1)
+            best_scores = np.take_along_axis(scores, top, axis=1)
+
+        order: np.ndarray = np.argsort(-best_scores, axis=1)
+
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(
+            best_scores, order, axis=1
+        )
+
+    @make_async
+    def query(
+        self,
+        query_embeddings: list[Embedding],
+        n_results: int,
+        where: Optional[dict] = None,
+    ) -> QueryResult:
+        result: QueryResult = dict(ids=[], distances=[], metadatas=[], documents=[])
+
+        with self._lock:
+            self._sync()
+            # vectors of another process are written before its rows are committed
+            rows: int = min(self._vectors.shape[0], len(self._live))
+            mask: np.ndarray = self._live[:rows].copy()
+
+            if where:
+                matching: np.ndarray = (
+                    np.asarray(self._table.find_labels(where), dtype=np.int64) - 1
+                )
+                filter_mask: np.ndarray = np.zeros(rows, dtype=bool)
+                filter_mask[matching[matching < rows]] = True
+                mask &= filter_mask
+
+            queries: np.ndarray = np.asarray(query_embeddings, dtype=np.float32)
+            queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            found_rows, scores = self._search(queries, n_results, mask)
+
+            for query_rows, query_scores in zip(found_rows, scores):
+                labels: list[int] = [
+                    int(row) + 1
+                    for row, score in zip(query_rows, query_scores)
+                    if score > -np.inf
+                ]
+                documents: dict[int, tuple[ID, Metadata, Document]] = (
+                    self._table.get_by_labels(labels)
+                )
+                # skip documents deleted by other processes after the sync
+                found: list[tuple[int, float]] = [
+                    (label, float(1 - score))
+                    for label, score in zip(labels, query_scores)
+                    if label in documents
+                ]
+
+                result["ids"].append([documents[label][0] for label, _ in found])
+                result["distances"].append([distance for _, distance in found])
+                result["metadatas"].append([documents[label][1] for label, _ in found])
+                result["documents"].append([documents[label][2] for label, _ in found])
+
+        return result
+
+    @make_async
+    def get(
+        self,
+        ids: Optional[IDs] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[list[str]] = None,
+    ) -> GetResult:
+        with self._lock:
+            rows: list[tuple[ID, Metadata, Document]] = self._table.get(
+                ids, where, limit, offset
+            )
+            include = include or []
+            embeddings: dict[ID, bytes] = (
+                self._table.get_embeddings([id for id, _, _ in rows])
+                if "embeddings" in include
+                else {}
+            )
+
+        return dict(
+            ids=[id for id, _, _ in rows],
+            metadatas=(
+                [metadata for _, metadata, _ in rows]
+                if "metadatas" in include
+                else None
+            ),
+            documents=(
+                [document for _, _, document in rows]
+                if "documents" in include
+                else None
+            ),
+            # vectors written before they were kept in the table are not available
+            embeddings=(
+                [
+                    (
+                        np.frombuffer(embeddings[id], dtype=np.float16).tolist()
+                        if embeddings.get(id)
+                        else None
+                    )
+                    for id, _, _ in rows
+                ]
+                if "embeddings" in include
+                else None
+            ),
+        )
+
+    @make_async
+    def upsert(
+        self,
+        ids: list[ID],
+        embeddings: list[Embedding],
+        metadatas: list[Metadata],
+        documents: list[Document],
+    ):
+        vectors: list[bytes] = self._to_vectors(embeddings)
+
+        with self._lock:
+            # vectors are in the file before documents become visible
+            self._table.upsert(
+                ids,
+                vectors,
+                metadatas,
+                documents,
+                before_commit=lambda labels: self._write(labels, vectors),
+            )
+            self._sync()
+
+    @make_async
+    def delete(self, ids: IDs):
+        with self._lock:
+            self._table.delete(ids)
+            self._sync()
+
+    @make_async
+    def count(self) -> int:
+        with self._lock:
+            return self._table.count()
+
+    @make_async
+    def drop(self):
+        with self._lock:
+            self._table.drop()
+            self._sync()
@@ -0,0 +1,370 @@
+import json
+import time
+from logging import getLogger
+from os import environ, makedirs, path, replace
+from threading import Lock
+from typing import Callable, Optional
+
+import numpy as np
+from chromadb.api.types import (
+    Embedding,
+    Metadata,
+    Document,
+    ID,
+    IDs,
+    QueryResult,
+    GetResult,
+)
+from portalocker import Lock as FileLock
+
+from chatbot.util.aio import make_async
+from .base import BaseVectorStore
+from .metadata import MetadataTable
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTOR_STORE_PATH = environ.get(
+    "VECTOR_STORE_PATH",
+    path.join(environ.get("FILE_STORAGE_PATH", "/tmp"), "vector_store"),
+)
+HNSW_M = int(environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(environ.get("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(environ.get("HNSW_EF_SEARCH", "100"))
+# seconds between index saves after changes
+HNSW_SAVE_INTERVAL = float(environ.get("HNSW_SAVE_INTERVAL", "60"))
+# filtered queries matching fewer documents are searched exactly
+HNSW_EXACT_SEARCH_LIMIT = int(environ.get("HNSW_EXACT_SEARCH_LIMIT", "10000"))
+INITIAL_CAPACITY = 10000
+# seconds to wait for another process saving or loading the index
+INDEX_LOCK_TIMEOUT = 300
+
+logger = getLogger(__name__)
+
+
+class HnswVectorStore(BaseVectorStore):
+    """Embedded vector store with in-process HNSW index
+
+    Documents, metadata and embeddings are stored in SQLite, which is the source of
+    truth. The index is persisted next to it and catches up with changes made by
+    other processes before every query.
+    """
+
+    def __init__(self, directory: str = VECTOR_STORE_PATH, dimensions: int = 768):
+        """Constructor"""
+        logger.debug("__init__, directory=%s, dimensions=%s", directory, dimensions)
+
+        if hnswlib is None:
+            raise RuntimeError("hnswlib is not installed")
+
+        self.directory: str = directory
+        self.dimensions: int = dimensions
+        self._lock: Lock = Lock()
+        self._table: Optional[MetadataTable] = None
+        self._index: Optional["hnswlib.Index"] = None
+        self._generation: int = 0
+        self._saved_generation: int = 0
+        self._saved_at: float = 0.0
+
+    @property
+    def _index_path(self) -> str:
+        return path.join(self.directory, "index.bin")
+
+    @property
+    def _state_path(self) -> str:
+        return path.join(self.directory, "index.json")
+
+    def _file_lock(self) -> FileLock:
+        """Lock keeping index and state files of one save together across processes"""
+        return FileLock(
+            path.join(self.directory, "index.lock"), timeout=INDEX_LOCK_TIMEOUT
+        )
+
+    def _read_saved_generation(self) -> Optional[int]:
+        """Get generation of the saved index, None if there is none"""
+        if not path.exists(self._index_path) or not path.exists(self._state_path):
+            return None
+
+        with open(self._state_path, "rt") as f:
+            return json.load(f)["generation"]
+
+    def create(self):
+        """Open storage and load index"""
+        with self._lock:
+            if self._table is not None:
+                return
+
+            makedirs(self.directory, exist_ok=True)
+            self._table = MetadataTable(path.join(self.directory, "documents.db"))
+            self._load()
+
+    def close(self):
+        """Save index and close storage"""
+        with self._lock:
+            if self._table is None:
+                return
+
+            self._save()
+            self._table.close()
+            self._table = None
+            self._index = None
+
+    def _new_index(self, capacity: int) -> "hnswlib.Index":
+        index = hnswlib.Index(space="cosine", dim=self.dimensions)
+        index.init_index(
+            max_elements=capacity, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M
+        )
+        index.set_ef(HNSW_EF_SEARCH)
+
+        return index
+
+    def _load(self):
+        """Load saved index, or build it from stored embeddings"""
+        self._index = None
+        self._generation = 0
+
+        try:
+            with self._file_lock():
+                generation: Optional[int] = self._read_saved_generation()
+
+                if generation is not None:
+                    index = hnswlib.Index(space="cosine", dim=self.dimensions)
+                    index.load_index(self._index_path)
+                    index.set_ef(HNSW_EF_SEARCH)
+                    self._index, self._generation = index, generation
+
+        except (OSError, RuntimeError, ValueError, KeyError) as error:
+            logger.warning("_load, cannot load index, rebuilding", exc_info=error)
+
+        if self._index is None:
+            self._index = self._new_index(max(INITIAL_CAPACITY, self._table.count()))
+
+        self._saved_generation = self._generation
+        self._saved_at = time.monotonic()
+        self._sync()
+        logger.info(
+            "_load, documents=%s, generation=%s", self._table.count(), self._generation
+        )
+
+    def _sync(self):
+        """Apply changes made after the loaded generation"""
+        if self._table.generation == self._generation:
+            return
+
+        changed, deleted, generation = self._table.get_changes(self._generation)
+        changed_count: int = 0
+
+        for batch in changed:
+            required: int = self._index.get_current_count() + len(batch)
+
+            if required > self._index.get_max_elements():
+                self._index.resize_index(
+                    max(required, 2 * self._index.get_max_elements())
+                )
+
+            self._index.add_items(
+                np.stack(
+                    [
+                        np.frombuffer(embedding, dtype=np.float32)
+                        for _, embedding in batch
+                    ]
+                ),
+                [label for label, _ in batch],
+            )
+            changed_count += len(batch)
+
+        for label in deleted:
+            try:
+                self._index.mark_deleted(label)
+            except RuntimeError:
+                # not in index or already deleted
+                pass
+
+        logger.debug(
+            "_sync, changed=%s, deleted=%s, generation=%s",
+            changed_count,
+            len(deleted),
+            generation,
+        )
+        self._generation = generation
+
+    def _save(self, force: bool = True):
+        """Save index if it has changes"""
+        if self._generation == self._saved_generation:
+            return
+
+        if not force and time.monotonic() - self._saved_at < HNSW_SAVE_INTERVAL:
+            return
+
+        with self._file_lock():
+            saved_generation: Optional[int] = self._read_saved_generation()
+
+            # another process has saved the same or a later state
+            if saved_generation is None or saved_generation < self._generation:
+                logger.debug("_save, generation=%s", self._generation)
+                self._index.save_index(f"{self._index_path}.tmp")
+                replace(f"{self._index_path}.tmp", self._index_path)
+
+                with open(f"{self._state_path}.tmp", "wt") as f:
+                    json.dump(dict(generation=self._generation), f)
+
+                replace(f"{self._state_path}.tmp", self._state_path)
+
+        self._saved_generation = self._generation
+        self._saved_at = time.monotonic()
+
+    def _search(
+        self, query: np.ndarray, n_results: int, labels: Optional[list[int]]
+    ) -> tuple[list[int], list[float]]:
+        """Search nearest labels, exactly for small filtered sets"""
+        if labels is not None and len(labels) <= HNSW_EXACT_SEARCH_LIMIT:
+            if len(labels) == 0:
+                return [], []
+
+            vectors: np.ndarray = np.asarray(
+                self._index.get_items(labels), dtype=np.float32
+            )
+            similarities: np.ndarray = vectors @ (query / np.linalg.norm(query))
+            similarities /= np.linalg.norm(vectors, axis=1)
+            order: np.ndarray = np.argsort(-similarities)[:n_results]
+
+            return [labels[i] for i in order], [
+                float(1 - similarities[i]) for i in order
+            ]
+
+        label_filter: Optional[Callable[[int], bool]] = None
+        k: int = min(n_results, self._table.count())
+
+        if labels is not None:
+            allowed: set[int] = set(labels)
+            label_filter = allowed.__contains__
+            k = min(k, len(allowed))
+
+        if k == 0:
+            return [], []
+
+        self._index.set_ef(max(HNSW_EF_SEARCH, k))
+        found_labels, distances = self._index.knn_query(query, k=k, filter=label_filter)
+
+        return found_labels[0].tolist(), distances[0].tolist()
+
+    @make_async
+    def query(
+        self,
+        query_embeddings: list[Embedding],
+        n_results: int,
+        where: Optional[dict] = None,
+    ) -> QueryResult:
+        result: QueryResult = dict(ids=[], distances=[], metadatas=[], documents=[])
+
+        with self._lock:
+            self._sync()
+            labels: Optional[list[int]] = (
+                self._table.find_labels(where) if where else None
+            )
+
+            for query_embedding in query_embeddings:
+                found_labels, distances = self._search(
+                    np.asarray(query_embedding, dtype=np.float32), n_results, labels
+                )
+                rows: dict[int, tuple[ID, Metadata, Document]] = (
+                    self._table.get_by_labels(found_labels)
+                )
+                # skip documents deleted by other processes after the sync
+                found: list[tuple[int, float]] = [
+                    (label, distance)
+                    for label, distance in zip(found_labels, distances)
+                    if label in rows
+                ]
+
+                result["ids"].append([rows[label][0] for label, _ in found])
+                result["distances"].append([distance for _, distance in found])
+                result["metadatas"].append([rows[label][1] for label, _ in found])
+                result["documents"].append([rows[label][2] for label, _ in found])
+
+        return result
+
+    @make_async
+    def get(
+        self,
+        ids: Optional[IDs] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[list[str]] = None,
+    ) -> GetResult:
+        with self._lock:
+            rows: list[tuple[ID, Metadata, Document]] = self._table.get(
+                ids, where, limit, offset
+            )
+            include = include or []
+            embeddings: dict[ID, bytes] = (
+                self._table.get_embeddings([id for id, _, _ in rows])
+                if "embeddings" in include
+                else {}
+            )
+
+        return dict(
+            ids=[id for id, _, _ in rows],
+            metadatas=(
+                [metadata for _, metadata, _ in rows]
+                if "metadatas" in include
+                else None
+            ),
+            documents=(
+                [document for _, _, document in rows]
+                if "documents" in include
+                else None
+            ),
+            embeddings=(
+                [
+                    (
+                        np.frombuffer(embeddings[id], dtype=np.float32).tolist()
+                        if embeddings.get(id)
+                        else None
+                    )
+                    for id, _, _ in rows
+                ]
+                if "embeddings" in include
+                else None
+            ),
+        )
+
+    @make_async
+    def upsert(
+        self,
+        ids: list[ID],
+        embeddings: list[Embedding],
+        metadatas: list[Metadata],
+        documents: list[Document],
+    ):
+        with self._lock:
+            self._table.upsert(
+                ids,
+                [np.asarray(e, dtype=np.float32).tobytes() for e in embeddings],
+                metadatas,
+                documents,
+            )
+            self._sync()
+            self._save(force=False)
+
+    @make_async
+    def delete(self, ids: IDs):
+        with self._lock:
+            self._table.delete(ids)
+            self._sync()
+            self._save(force=False)
+
+    @make_async
+    def count(self) -> int:
+        with self._lock:
+            return self._table.count()
+
+    @make_async
+    def drop(self):
+        with self._lock:
+            self._table.drop()
+            self._sync()
+            self._save()
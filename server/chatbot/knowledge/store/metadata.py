@@ -0,0 +1,326 @@
+import json
+import sqlite3
+from logging import getLogger
+from typing import Any, Callable, Iterator, Optional
+
+from chromadb.api.types import Metadata, Document, ID, IDs
+
+# max number of query parameters in a single SQLite statement
+MAX_VARIABLES = 900
+COMPARISON_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+logger = getLogger(__name__)
+
+
+def get_where_clause(where: Optional[dict]) -> tuple[str, list[Any]]:
+    """Convert Chroma metadata filter to SQL condition with parameters"""
+    if not where:
+        return "1", []
+
+    conditions: list[str] = []
+    params: list[Any] = []
+
+    for key, value in where.items():
+        condition: str
+
+        if key in ("$and", "$or"):
+            clauses: list[tuple[str, list[Any]]] = [get_where_clause(w) for w in value]
+            condition = f" {key[1:].upper()} ".join(f"({c})" for c, _ in clauses)
+            params += [param for _, clause_params in clauses for param in clause_params]
+
+        else:
+            field: str = "json_extract(metadata, ?)"
+            path: str = '$."' + key.replace('"', '\\"') + '"'
+            operator, operand = (
+                next(iter(value.items())) if isinstance(value, dict) else ("$eq", value)
+            )
+
+            if operator in ("$in", "$nin"):
+                placeholders: str = ",".join("?" * len(operand))
+                condition = (
+                    f"{field} {'NOT ' if operator == '$nin' else ''}IN ({placeholders})"
+                )
+                params += [path, *operand]
+
+            elif operator in COMPARISON_OPERATORS:
+                condition = f"{field} {COMPARISON_OPERATORS[operator]} ?"
+                params += [path, operand]
+
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+
+        conditions.append(condition)
+
+    return " AND ".join(f"({c})" for c in conditions), params
+
+
+def _chunks(items: list, size: int = MAX_VARIABLES) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class MetadataTable:
+    """SQLite table of documents and their metadata for local vector stores
+
+    Documents are addressed by integer labels in vector indexes. Every change
+    increments the generation, so that other processes can catch up with it.
+    """
+
+    def __init__(self, file_path: str):
+        """Constructor"""
+        logger.debug("__init__, file_path=%s", file_path)
+
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            file_path, timeout=30, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS document ("
+            "label INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+            "metadata TEXT NOT NULL, document TEXT, embedding BLOB NOT NULL, "
+            "generation INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS document_generation ON document (generation)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS deleted_document "
+            "(label INTEGER PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS deleted_document_generation "
+            "ON deleted_document (generation)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.connection.execute(
+            "INSERT OR IGNORE INTO state (key, value) VALUES ('generation', 0)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        """Close connection"""
+        self.connection.close()
+
+    @property
+    def generation(self) -> int:
+        """Get generation of the latest change"""
+        return self.connection.execute(
+            "SELECT value FROM state WHERE key = 'generation'"
+        ).fetchone()[0]
+
+    def _next_generation(self) -> int:
+        self.connection.execute(
+            "UPDATE state SET value = value + 1 WHERE key = 'generation'"
+        )
+        return self.generation
+
+    def upsert(
+        self,
+        ids: list[ID],
+        embeddings: list[bytes],
+        metadatas: list[Metadata],
+        documents: list[Document],
+        before_commit: Optional[Callable[[list[int]], None]] = None,
+    ) -> list[int]:
+        """Insert/update documents, returns their labels
+
+        before_commit is called with the labels inside the transaction, an error
+        raised by it rolls the change back
+        """
+        with self.connection:
+            generation: int = self._next_generation()
+            self.connection.executemany(
+                "INSERT INTO document (id, metadata, document, embedding, generation) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "metadata = excluded.metadata, document = excluded.document, "
+                "embedding = excluded.embedding, generation = excluded.generation",
+                [
+                    (id, json.dumps(metadata), document, embedding, generation)
+                    for id, metadata, document, embedding in zip(
+                        ids, metadatas, documents, embeddings
+                    )
+                ],
+            )
+
+            labels: list[int] = self.get_labels(ids)
+
+            if before_commit is not None:
+                before_commit(labels)
+
+            return labels
+
+    def delete(self, ids: IDs) -> list[int]:
+        """Delete documents, returns their labels"""
+        with self.connection:
+            generation: int = self._next_generation()
+            labels: list[int] = self.get_labels(ids)
+
+            for chunk in _chunks(labels):
+                self.connection.execute(
+                    f"DELETE FROM document WHERE label IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO deleted_document (label, generation) "
+                "VALUES (?, ?)",
+                [(label, generation) for label in labels],
+            )
+
+        return labels
+
+    def drop(self):
+        """Delete all documents"""
+        with self.connection:
+            generation: int = self._next_generation()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO deleted_document (label, generation) "
+                "SELECT label, ? FROM document",
+                (generation,),
+            )
+            self.connection.execute("DELETE FROM document")
+
+    def count(self) -> int:
+        """Get document count"""
+        return self.connection.execute("SELECT COUNT(*) FROM document").fetchone()[0]
+
+    def get_labels(self, ids: IDs) -> list[int]:
+        """Get labels of existing documents, in order of ids"""
+        labels: dict[str, int] = {}
+
+        for chunk in _chunks(ids):
+            labels |= dict(
+                self.connection.execute(
+                    "SELECT id, label FROM document "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            )
+
+        return [labels[id] for id in ids if id in labels]
+
+    def get_embeddings(self, ids: IDs) -> dict[ID, bytes]:
+        """Get stored embeddings of existing documents by id"""
+        embeddings: dict[ID, bytes] = {}
+
+        for chunk in _chunks(ids):
+            embeddings |= dict(
+                self.connection.execute(
+                    "SELECT id, embedding FROM document "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            )
+
+        return embeddings
+
+    def find_labels(self, where: Optional[dict]) -> list[int]:
+        """Get labels of documents matching the filter"""
+        condition, params = get_where_clause(where)
+
+        return [
+            row[0]
+            for row in self.connection.execute(
+                f"SELECT label FROM document WHERE {condition}", params
+            )
+        ]
+
+    def get_by_labels(
+        self, labels: list[int]
+    ) -> dict[int, tuple[ID, Metadata, Document]]:
+        """Get id, metadata and document by label"""
+        result: dict[int, tuple[ID, Metadata, Document]] = {}
+
+        for chunk in _chunks(labels):
+            for label, id, metadata, document in self.connection.execute(
+                "SELECT label, id, metadata, document FROM document "
+                f"WHERE label IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                result[label] = (id, json.loads(metadata), document)
+
+        return result
+
+    def get(
+        self,
+        ids: Optional[IDs] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> list[tuple[ID, Metadata, Document]]:
+        """Get id, metadata and document of documents by ids and filter"""
+        condition, params = get_where_clause(where)
+
+        if ids is not None:
+            labels: list[int] = self.get_labels(ids)
+            condition += f" AND label IN ({','.join(map(str, labels))})"
+
+        rows: list[tuple[str, str, str]] = self.connection.execute(
+            f"SELECT id, metadata, document FROM document WHERE {condition} "
+            "ORDER BY label LIMIT ? OFFSET ?",
+            [*params, -1 if limit is None else limit, offset or 0],
+        ).fetchall()
+
+        return [(id, json.loads(metadata), document) for id, metadata, document in rows]
+
+    def get_changes(
+        self, generation: int, with_embeddings: bool = True, batch_size: int = 10000
+    ) -> tuple[Iterator[list[tuple[int, Optional[bytes]]]], list[int], int]:
+        """Get batches of documents changed after generation as (label, embedding),
+        labels of documents deleted after it and the current generation
+
+        Changed documents are read lazily, so that embeddings of a whole collection
+        are not held in memory at once
+        """
+        with self.connection:
+            current_generation: int = self.generation
+            deleted: list[int] = [
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT label FROM deleted_document WHERE generation > ?",
+                    (generation,),
+                )
+            ]
+
+        def iter_changed() -> Iterator[list[tuple[int, Optional[bytes]]]]:
+            cursor: sqlite3.Cursor = self.connection.execute(
+                f"SELECT label, {'embedding' if with_embeddings else 'NULL'} "
+                "FROM document WHERE generation > ? ORDER BY label",
+                (generation,),
+            )
+
+            try:
+                while rows := cursor.fetchmany(batch_size):
+                    yield rows
+            finally:
+                cursor.close()
+
+        return iter_changed(), deleted, current_generation
+
+    def iter_embeddings(
+        self, min_label: int = 0, batch_size: int = 10000
+    ) -> Iterator[list[tuple[int, bytes]]]:
+        """Get (label, embedding) of documents with labels above min_label in
+        batches"""
+        while True:
+            rows: list[tuple[int, bytes]] = self.connection.execute(
+                "SELECT label, embedding FROM document WHERE label > ? "
+                "ORDER BY label LIMIT ?",
+                (min_label, batch_size),
+            ).fetchall()
+
+            if len(rows) == 0:
+                return
+
+            yield rows
+            min_label = rows[-1][0]
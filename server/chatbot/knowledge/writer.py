@@ -0,0 +1,100 @@
+from logging import getLogger
+from os import environ
+from typing import Optional
+
+from chromadb.api.types import Embedding, Metadata, Document, ID, IDs
+
+from .collection import DocumentCollection
+
+UPSERT_BATCH_SIZE = int(environ.get("UPSERT_BATCH_SIZE", "500"))
+UPSERT_BATCH_BYTES = int(environ.get("UPSERT_BATCH_BYTES", str(8 * 1024 * 1024)))
+# approximate size of a single serialized embedding value in a request body
+EMBEDDING_VALUE_BYTES = 20
+
+logger = getLogger(__name__)
+
+
+class DocumentWriter:
+    """Buffered bulk writer for document collection
+
+    Accumulates documents and upserts them in batches, limited by document count
+    and approximate request size. Use as async context manager to flush the rest
+    of the buffer on exit.
+    """
+
+    def __init__(
+        self,
+        collection: DocumentCollection,
+        max_count: int = UPSERT_BATCH_SIZE,
+        max_bytes: int = UPSERT_BATCH_BYTES,
+    ):
+        """Constructor"""
+        logger.debug("__init__, max_count=%s, max_bytes=%s", max_count, max_bytes)
+
+        self.collection: DocumentCollection = collection
+        self.max_count: int = max_count
+        self.max_bytes: int = max_bytes
+        self.written: int = 0
+
+        self._ids: IDs = []
+        self._embeddings: list[Embedding] = []
+        self._metadatas: list[Metadata] = []
+        self._documents: list[Document] = []
+        self._size: int = 0
+
+    @staticmethod
+    def _get_size(embedding: Embedding, metadata: Metadata, document: Document) -> int:
+        """Estimate serialized size of a document"""
+        return (
+            len(document.encode("utf-8"))
+            + len(embedding) * EMBEDDING_VALUE_BYTES
+            + sum(len(str(k)) + len(str(v)) for k, v in metadata.items())
+        )
+
+    async def add(
+        self, id: ID, embedding: Embedding, metadata: Metadata, document: Document
+    ):
+        """Add document to buffer, flushing it when limits are reached"""
+        size: int = self._get_size(embedding, metadata, document)
+
+        if len(self._ids) > 0 and self._size + size > self.max_bytes:
+            await self.flush()
+
+        self._ids.append(id)
+        self._embeddings.append(embedding)
+        self._metadatas.append(metadata)
+        self._documents.append(document)
+        self._size += size
+
+        if len(self._ids) >= self.max_count:
+            await self.flush()
+
+    async def flush(self):
+        """Upsert buffered documents"""
+        if len(self._ids) == 0:
+            return
+
+        logger.debug("flush, documents=%s, size=%s", len(self._ids), self._size)
+
+        await self.collection.upsert(
+            ids=self._ids,
+            embeddings=self._embeddings,
+            metadatas=self._metadatas,
+            documents=self._documents,
+        )
+        self.written += len(self._ids)
+
+        self._ids = []
+        self._embeddings = []
+        self._metadatas = []
+        self._documents = []
+        self._size = 0
+
+    async def __aenter__(self) -> "DocumentWriter":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> Optional[bool]:
+        if exc_type is None:
+            await self.flush()
+
+        return None
@@ -1,3 +1,4 @@
+from os import environ
 from typing import List, Sequence, Optional
 from logging import getLogger
 from uuid import uuid4
@@ -6,6 +7,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from chatbot.db.model.configuration import Config, Configuration, Language
 
 DEFAULT_LANGUAGE = "en"
+# E5 or E5Onnx, both produce compatible embeddings
+EMBEDDING_MODEL = environ.get("EMBEDDING_MODEL", "E5")
 
 logger = getLogger(__name__)
 
@@ -80,7 +83,7 @@ async def get_language(db: AsyncSession) -> str:
 async def get_embedding_model() -> str:
     """Get embedding model configuration"""
     logger.debug("get_embedding_model")
-    return "E5"
+    return EMBEDDING_MODEL
 
 
 async def get_language_list(db: AsyncSession) -> Sequence[Language]:
@@ -1,11 +1,22 @@
 from .factory import EmbeddingModelFactory
 from .e5 import E5
+from .e5_onnx import E5Onnx
 from .base import BaseEmbeddingModel
+from .cache import BaseEmbeddingCache, get_cache, get_key as get_cache_key
+from .dispatcher import EmbeddingDispatcher, get_dispatcher
+from .executor import shutdown_executor
 
 factory: EmbeddingModelFactory = EmbeddingModelFactory()
 factory.register(E5)
+factory.register(E5Onnx)
 
 __all__ = [
     "factory",
-    "BaseEmbeddingModel"
+    "BaseEmbeddingModel",
+    "BaseEmbeddingCache",
+    "get_cache",
+    "get_cache_key",
+    "EmbeddingDispatcher",
+    "get_dispatcher",
+    "shutdown_executor",
 ]
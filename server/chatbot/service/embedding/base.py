@@ -5,6 +5,31 @@ from typing import List
 class BaseEmbeddingModel(ABC):
     """Base embedding model class"""
 
+    # maximum number of tokens the model can embed, including special tokens
+    MAX_SEQUENCE_LENGTH: int = 512
+
+    def get_token_counts(self, texts: List[str]) -> List[int]:
+        """Get number of tokens in texts, without special tokens
+
+        Default implementation counts characters, models should override it with
+        their tokenizer.
+        """
+        return [len(text) for text in texts]
+
+    def get_prefix(self, is_query: bool) -> str:
+        """Get prefix the model adds to a text before embedding it"""
+        return ""
+
     @abstractmethod
     async def generate_embedding(self, is_query: bool, text: str) -> List[float]:
         """Generate embedding from text"""
+
+    async def generate_embeddings(
+        self, is_query: bool, texts: List[str]
+    ) -> List[List[float]]:
+        """Generate embeddings for a list of texts
+
+        Default implementation embeds texts one by one, models supporting batched
+        inference should override it.
+        """
+        return [await self.generate_embedding(is_query, text) for text in texts]
@@ -0,0 +1,261 @@
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from array import array
+from hashlib import sha256
+from logging import getLogger
+from os import environ, getpid, path
+from threading import Lock
+from typing import List, Optional
+
+from redis.asyncio.client import Redis
+
+from chatbot.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+from chatbot.util.aio import make_async
+
+# disk, redis or none
+EMBEDDING_CACHE = environ.get("EMBEDDING_CACHE", "disk").lower()
+EMBEDDING_CACHE_PATH = environ.get(
+    "EMBEDDING_CACHE_PATH",
+    path.join(environ.get("FILE_STORAGE_PATH", "/tmp"), "embedding_cache.db"),
+)
+EMBEDDING_CACHE_MAX_ITEMS = int(environ.get("EMBEDDING_CACHE_MAX_ITEMS", "200000"))
+# redis cache relies on TTL and redis maxmemory policy instead of item limit
+EMBEDDING_CACHE_TTL = int(environ.get("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+REDIS_KEY_PREFIX = "embedding:"
+# fraction of the limit evicted at once, so eviction doesn't run on every write;
+# items are counted again after this fraction of the limit is written
+EVICTION_SLACK = 0.05
+# access times of cache hits are written in batches, by count or seconds
+ACCESS_FLUSH_SIZE = 1000
+ACCESS_FLUSH_INTERVAL = 60
+
+logger = getLogger(__name__)
+
+
+def get_key(model_name: str, prefix: str, text: str) -> str:
+    """Get cache key for embedding of a text"""
+    return sha256(f"{model_name}\0{prefix}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _serialize(embedding: List[float]) -> bytes:
+    """Serialize embedding to bytes"""
+    return array("f", embedding).tobytes()
+
+
+def _deserialize(value: bytes) -> List[float]:
+    """Deserialize embedding from bytes"""
+    embedding: array = array("f")
+    embedding.frombytes(value)
+
+    return embedding.tolist()
+
+
+class BaseEmbeddingCache(ABC):
+    """Base embedding cache"""
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Get embeddings by keys, None for missing ones"""
+
+    @abstractmethod
+    async def set_many(self, items: dict[str, List[float]]):
+        """Store embeddings by keys"""
+
+
+class DiskEmbeddingCache(BaseEmbeddingCache):
+    """SQLite-based embedding cache with LRU eviction"""
+
+    def __init__(self, file_path: str, max_items: int):
+        """Constructor"""
+        logger.debug("__init__, file_path=%s, max_items=%s", file_path, max_items)
+
+        self.file_path: str = file_path
+        self.max_items: int = max_items
+        self._lock: Lock = Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        # item count at the last count, None when not counted yet
+        self._count: Optional[int] = None
+        # items written since the last count
+        self._written: int = 0
+        # access times of hits not written yet, by key
+        self._accessed: dict[str, float] = {}
+        self._flushed_at: float = time.monotonic()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get or open connection, once per process"""
+        if self._connection is None or self._pid != getpid():
+            logger.info("_get_connection, opening %s", self.file_path)
+
+            self._connection = sqlite3.connect(
+                self.file_path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embedding "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS embedding_accessed_at "
+                "ON embedding (accessed_at)"
+            )
+            self._connection.commit()
+            self._pid = getpid()
+            self._count = None
+            self._written = 0
+            self._accessed = {}
+
+        return self._connection
+
+    @make_async
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Get embeddings by keys, None for missing ones"""
+        if len(keys) == 0:
+            return []
+
+        with self._lock:
+            connection: sqlite3.Connection = self._get_connection()
+            placeholders: str = ",".join("?" * len(keys))
+            rows: dict[str, bytes] = dict(
+                connection.execute(
+                    f"SELECT key, value FROM embedding WHERE key IN ({placeholders})",
+                    keys,
+                ).fetchall()
+            )
+
+            now: float = time.time()
+            self._accessed.update((key, now) for key in rows)
+
+            # hits don't write on every lookup, their access times are batched
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE or (
+                len(self._accessed) > 0
+                and time.monotonic() - self._flushed_at >= ACCESS_FLUSH_INTERVAL
+            ):
+                self._flush_accessed(connection)
+                connection.commit()
+
+        logger.debug("get_many, keys=%s, found=%s", len(keys), len(rows))
+
+        return [_deserialize(rows[key]) if key in rows else None for key in keys]
+
+    @make_async
+    def set_many(self, items: dict[str, List[float]]):
+        """Store embeddings by keys, evicting least recently used ones"""
+        if len(items) == 0:
+            return
+
+        logger.debug("set_many, items=%s", len(items))
+        now: float = time.time()
+
+        with self._lock:
+            connection: sqlite3.Connection = self._get_connection()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embedding (key, value, accessed_at) VALUES (?, ?, ?)",
+                [(key, _serialize(value), now) for key, value in items.items()],
+            )
+
+            self._flush_accessed(connection)
+            self._written += len(items)
+
+            if (
+                self._count is None
+                or self._count + self._written > self.max_items
+                or self._written >= self.max_items * EVICTION_SLACK
+            ):
+                self._evict(connection)
+
+            connection.commit()
+
+    def _flush_accessed(self, connection: sqlite3.Connection):
+        """Write pending access times of cache hits, in the caller's transaction"""
+        if len(self._accessed) > 0:
+            connection.executemany(
+                "UPDATE embedding SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed = {}
+
+        self._flushed_at = time.monotonic()
+
+    def _evict(self, connection: sqlite3.Connection):
+        """Count items and evict least recently used ones above the limit"""
+        count: int = connection.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+
+        if count > self.max_items:
+            evict: int = count - self.max_items + int(self.max_items * EVICTION_SLACK)
+            logger.info("_evict, count=%s, evicting=%s", count, evict)
+
+            connection.execute(
+                "DELETE FROM embedding WHERE key IN "
+                "(SELECT key FROM embedding ORDER BY accessed_at LIMIT ?)",
+                (evict,),
+            )
+            count -= evict
+
+        self._count = count
+        self._written = 0
+
+
+class RedisEmbeddingCache(BaseEmbeddingCache):
+    """Redis-based embedding cache"""
+
+    def __init__(self, ttl: int):
+        """Constructor"""
+        logger.debug("__init__, ttl=%s", ttl)
+
+        self.ttl: int = ttl
+        self._connection: Redis = Redis(
+            host=REDIS_HOST,
+            port=int(REDIS_PORT),
+            password=REDIS_PASSWORD,
+        )
+
+    async def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Get embeddings by keys, None for missing ones"""
+        if len(keys) == 0:
+            return []
+
+        values: List[Optional[bytes]] = await self._connection.mget(
+            [REDIS_KEY_PREFIX + key for key in keys]
+        )
+        logger.debug(
+            "get_many, keys=%s, found=%s",
+            len(keys),
+            len([v for v in values if v is not None]),
+        )
+
+        return [_deserialize(value) if value is not None else None for value in values]
+
+    async def set_many(self, items: dict[str, List[float]]):
+        """Store embeddings by keys"""
+        if len(items) == 0:
+            return
+
+        logger.debug("set_many, items=%s", len(items))
+
+        async with self._connection.pipeline(transaction=False) as pipeline:
+            for key, value in items.items():
+                pipeline.set(REDIS_KEY_PREFIX + key, _serialize(value), ex=self.ttl)
+
+            await pipeline.execute()
+
+
+_cache: Optional[BaseEmbeddingCache] = None
+
+
+def get_cache() -> Optional[BaseEmbeddingCache]:
+    """Get configured embedding cache, None if caching is disabled"""
+    global _cache
+
+    if _cache is None:
+        match EMBEDDING_CACHE:
+            case "disk":
+                _cache = DiskEmbeddingCache(
+                    EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ITEMS
+                )
+            case "redis":
+                _cache = RedisEmbeddingCache(EMBEDDING_CACHE_TTL)
+
+    return _cache
@@ -0,0 +1,211 @@
+import asyncio
+from asyncio import AbstractEventLoop, Event, Future, Queue, Semaphore, Task
+from logging import getLogger
+from os import environ
+from typing import List, Optional
+
+from .base import BaseEmbeddingModel
+from .executor import EMBEDDING_WORKERS
+from .factory import EmbeddingModelFactory
+
+# how long the first request waits for others to join its batch, in seconds
+EMBEDDING_DISPATCH_MAX_WAIT = float(environ.get("EMBEDDING_DISPATCH_MAX_WAIT", "0.01"))
+# number of texts after which a batch is sent to the model without waiting
+EMBEDDING_DISPATCH_MAX_BATCH = int(environ.get("EMBEDDING_DISPATCH_MAX_BATCH", "32"))
+
+logger = getLogger(__name__)
+
+
+class EmbeddingRequest:
+    """Pending embedding request"""
+
+    def __init__(self, is_query: bool, texts: List[str], future: Future):
+        """Constructor"""
+        self.is_query: bool = is_query
+        self.texts: List[str] = texts
+        self.future: Future = future
+
+
+class EmbeddingDispatcher:
+    """Embedding dispatcher, coalescing concurrent requests into batches
+
+    Requests arriving within max_wait seconds of each other are embedded by a
+    single model call, until the batch reaches max_batch texts. Larger requests are
+    split into batches of max_batch texts. Queries are dispatched ahead of passages,
+    and up to concurrency batches are embedded at once.
+    """
+
+    def __init__(
+        self,
+        model: BaseEmbeddingModel,
+        max_wait: float = EMBEDDING_DISPATCH_MAX_WAIT,
+        max_batch: int = EMBEDDING_DISPATCH_MAX_BATCH,
+        concurrency: int = EMBEDDING_WORKERS,
+    ):
+        """Constructor"""
+        logger.debug(
+            "__init__, model=%s, max_wait=%s, max_batch=%s, concurrency=%s",
+            model,
+            max_wait,
+            max_batch,
+            concurrency,
+        )
+
+        self.model: BaseEmbeddingModel = model
+        self.max_wait: float = max_wait
+        self.max_batch: int = max_batch
+        # pending requests by is_query
+        self._queues: dict[bool, Queue[EmbeddingRequest]] = {
+            True: Queue(),
+            False: Queue(),
+        }
+        self._arrived: Event = Event()
+        self._slots: Semaphore = Semaphore(concurrency)
+        self._running: set[Task] = set()
+        self._task: Optional[Task] = None
+
+    async def generate_embeddings(
+        self, is_query: bool, texts: List[str]
+    ) -> List[List[float]]:
+        """Generate embeddings, sharing model calls with concurrent requests"""
+        if len(texts) == 0:
+            return []
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        loop: AbstractEventLoop = asyncio.get_running_loop()
+        futures: List[Future] = []
+
+        for start in range(0, len(texts), self.max_batch):
+            future: Future = loop.create_future()
+            self._queues[is_query].put_nowait(
+                EmbeddingRequest(
+                    is_query, texts[start : start + self.max_batch], future
+                )
+            )
+            futures.append(future)
+
+        self._arrived.set()
+        results: List[List[List[float]]] = await asyncio.gather(*futures)
+
+        return [embedding for result in results for embedding in result]
+
+    async def _wait(self, timeout: Optional[float]) -> bool:
+        """Wait for a new request, False after timeout"""
+        self._arrived.clear()
+
+        try:
+            await asyncio.wait_for(self._arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    async def _collect(self) -> List[EmbeddingRequest]:
+        """Wait for a request and collect the ones of the same kind arriving shortly
+        after it, queries are taken first"""
+        loop: AbstractEventLoop = asyncio.get_running_loop()
+
+        while self._queues[True].empty() and self._queues[False].empty():
+            await self._wait(None)
+
+        is_query: bool = not self._queues[True].empty()
+        queue: Queue[EmbeddingRequest] = self._queues[is_query]
+        batch: List[EmbeddingRequest] = [queue.get_nowait()]
+        size: int = len(batch[0].texts)
+        deadline: float = loop.time() + self.max_wait
+
+        while size < self.max_batch:
+            if not queue.empty():
+                request: EmbeddingRequest = queue.get_nowait()
+                batch.append(request)
+                size += len(request.texts)
+                continue
+
+            timeout: float = deadline - loop.time()
+
+            # passages are sent without waiting for more when queries are pending
+            if (
+                timeout <= 0
+                or (not is_query and not self._queues[True].empty())
+                or not await self._wait(timeout)
+            ):
+                break
+
+        return batch
+
+    async def _process(self, is_query: bool, requests: List[EmbeddingRequest]):
+        """Embed texts of the requests in one call and resolve their futures"""
+        requests = [r for r in requests if not r.future.done()]
+
+        if len(requests) == 0:
+            return
+
+        texts: List[str] = [text for r in requests for text in r.texts]
+        logger.debug(
+            "_process, is_query=%s, requests=%s, texts=%s",
+            is_query,
+            len(requests),
+            len(texts),
+        )
+
+        try:
+            embeddings: List[List[float]] = await self.model.generate_embeddings(
+                is_query, texts
+            )
+        except Exception as error:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(error)
+
+            return
+
+        offset: int = 0
+
+        for request in requests:
+            if not request.future.done():
+                request.future.set_result(
+                    embeddings[offset : offset + len(request.texts)]
+                )
+
+            offset += len(request.texts)
+
+    async def _run(self):
+        """Dispatch loop"""
+        logger.debug("_run, started")
+
+        while True:
+            await self._slots.acquire()
+
+            try:
+                batch: List[EmbeddingRequest] = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            task: Task = asyncio.create_task(self._process(batch[0].is_query, batch))
+            self._running.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task: Task):
+        """Release the slot of a finished batch"""
+        self._running.discard(task)
+        self._slots.release()
+
+
+# dispatchers are bound to the event loop they were created in
+_dispatchers: dict[tuple[str, AbstractEventLoop], EmbeddingDispatcher] = {}
+
+
+def get_dispatcher(model_name: str) -> EmbeddingDispatcher:
+    """Get dispatcher for the model in the running event loop"""
+    key: tuple[str, AbstractEventLoop] = (model_name, asyncio.get_running_loop())
+
+    if key not in _dispatchers:
+        for stale_key in [k for k in _dispatchers if k[1].is_closed()]:
+            del _dispatchers[stale_key]
+
+        _dispatchers[key] = EmbeddingDispatcher(EmbeddingModelFactory().get(model_name))
+
+    return _dispatchers[key]
@@ -1,12 +1,21 @@
 from logging import getLogger
 from os import environ
+from threading import Lock
 from typing import List
 
-from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
 
 from .base import BaseEmbeddingModel
+from .executor import run_in_executor
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # torch is not needed by the ONNX backend
+    SentenceTransformer = None
 
 MODEL_PATH = environ.get("E5_MODEL_PATH", "/media/love/ml/multilingual-e5-base")
+BATCH_SIZE = int(environ.get("E5_BATCH_SIZE", "32"))
 QUERY_PREFIX = "query: "
 PASSAGE_PREFIX = "passage: "
 
@@ -16,28 +25,73 @@ logger = getLogger(__name__)
 class E5(BaseEmbeddingModel):
     """E5 language embedding model"""
 
+    MAX_SEQUENCE_LENGTH: int = 512
+
     _model: SentenceTransformer = None
+    _tokenizer: PreTrainedTokenizerBase = None
+    _lock: Lock = Lock()
 
     @classmethod
     def get_model(cls) -> SentenceTransformer:
         """Get or load model"""
-        if cls._model is None:
-            logger.info("loading model")
-            cls._model = SentenceTransformer(MODEL_PATH)
+        if SentenceTransformer is None:
+            raise RuntimeError("sentence-transformers is not installed")
+
+        with cls._lock:
+            if cls._model is None:
+                logger.info("loading model")
+                cls._model = SentenceTransformer(MODEL_PATH)
 
         return cls._model
 
+    @classmethod
+    def get_tokenizer(cls) -> PreTrainedTokenizerBase:
+        """Get or load tokenizer, without loading the model itself"""
+        with cls._lock:
+            if cls._tokenizer is None:
+                logger.info("loading tokenizer")
+                cls._tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+
+        return cls._tokenizer
+
+    def get_token_counts(self, texts: List[str]) -> List[int]:
+        """Get number of tokens in texts, without special tokens"""
+        tokenizer: PreTrainedTokenizerBase = E5.get_tokenizer()
+        input_ids: List[List[int]] = tokenizer(texts, add_special_tokens=False)[
+            "input_ids"
+        ]
+
+        return [len(ids) for ids in input_ids]
+
+    def get_prefix(self, is_query: bool) -> str:
+        """Get prefix the model adds to a text before embedding it"""
+        return QUERY_PREFIX if is_query else PASSAGE_PREFIX
+
     async def generate_embedding(self, is_query: bool, text: str) -> List[float]:
         """Generate embedding from text"""
         logger.debug(
             "generate_embedding, is_query=%s, text=%s", is_query, text[:20] + "..."
         )
-        prefix: str = QUERY_PREFIX if is_query else PASSAGE_PREFIX
-        input_text: str = prefix + text
+        return (await self.generate_embeddings(is_query, [text]))[0]
+
+    async def generate_embeddings(
+        self, is_query: bool, texts: List[str]
+    ) -> List[List[float]]:
+        """Generate embeddings for a list of texts, encoding them in batches"""
+        logger.debug("generate_embeddings, is_query=%s, texts=%s", is_query, len(texts))
+        prefix: str = self.get_prefix(is_query)
+        input_texts: List[str] = [prefix + text for text in texts]
+
+        return await run_in_executor(_encode, input_texts)
+
 
-        model: SentenceTransformer = E5.get_model()
-        embedding: List[float] = model.encode(
-            input_text, normalize_embeddings=True, show_progress_bar=False
-        ).tolist()
+def _encode(input_texts: List[str]) -> List[List[float]]:
+    """Encode texts with the model loaded in the current process"""
+    model: SentenceTransformer = E5.get_model()
 
-        return embedding
+    return model.encode(
+        input_texts,
+        batch_size=BATCH_SIZE,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).tolist()
@@ -0,0 +1,154 @@
+from logging import getLogger
+from os import environ, makedirs, path
+from threading import Lock
+from typing import List, Optional
+
+import numpy as np
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+
+from .e5 import E5, MODEL_PATH, BATCH_SIZE, QUERY_PREFIX
+from .executor import run_in_executor
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+ONNX_MODEL_PATH = environ.get("E5_ONNX_MODEL_PATH", path.join(MODEL_PATH, "onnx"))
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+ONNX_QUANTIZE = environ.get("E5_ONNX_QUANTIZE", "false").lower() in ("true", "1")
+# onnxruntime intra-op threads, 0 keeps onnxruntime default
+ONNX_THREADS = int(environ.get("E5_ONNX_THREADS", "0"))
+
+logger = getLogger(__name__)
+
+
+class E5Onnx(E5):
+    """E5 language embedding model running on ONNX Runtime
+
+    Uses the same tokenizer, prefixes, mean pooling and normalization as E5, so
+    embeddings of both backends are interchangeable.
+    """
+
+    _session: Optional["onnxruntime.InferenceSession"] = None
+    _lock: Lock = Lock()
+
+    @staticmethod
+    def export(model_path: str = MODEL_PATH, output_path: str = ONNX_MODEL_PATH):
+        """Export E5 transformer to ONNX format"""
+        import torch
+        from transformers import AutoModel
+
+        logger.info("export, model_path=%s, output_path=%s", model_path, output_path)
+
+        tokenizer: PreTrainedTokenizerBase = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModel.from_pretrained(model_path)
+        model.eval()
+        makedirs(output_path, exist_ok=True)
+
+        sample: dict = tokenizer([QUERY_PREFIX], return_tensors="pt")
+        axes: dict[int, str] = {0: "batch", 1: "sequence"}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"]),
+                path.join(output_path, ONNX_MODEL_FILE),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": axes,
+                    "attention_mask": axes,
+                    "last_hidden_state": axes,
+                },
+                opset_version=14,
+            )
+
+    @staticmethod
+    def _get_model_file() -> str:
+        """Get ONNX model file, quantizing the exported model if required"""
+        model_file: str = path.join(ONNX_MODEL_PATH, ONNX_MODEL_FILE)
+
+        if not ONNX_QUANTIZE:
+            return model_file
+
+        quantized_model_file: str = path.join(
+            ONNX_MODEL_PATH, ONNX_QUANTIZED_MODEL_FILE
+        )
+
+        if not path.exists(quantized_model_file):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info("quantizing model to %s", quantized_model_file)
+            quantize_dynamic(
+                model_file, quantized_model_file, weight_type=QuantType.QInt8
+            )
+
+        return quantized_model_file
+
+    @classmethod
+    def get_model(
+        cls,
+    ) -> tuple["onnxruntime.InferenceSession", PreTrainedTokenizerBase]:
+        """Get or load inference session and tokenizer"""
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed")
+
+        with cls._lock:
+            if cls._session is None:
+                logger.info("loading model")
+
+                options = onnxruntime.SessionOptions()
+
+                if ONNX_THREADS > 0:
+                    options.intra_op_num_threads = ONNX_THREADS
+
+                cls._session = onnxruntime.InferenceSession(
+                    cls._get_model_file(),
+                    options,
+                    providers=["CPUExecutionProvider"],
+                )
+
+        return cls._session, E5.get_tokenizer()
+
+    async def generate_embeddings(
+        self, is_query: bool, texts: List[str]
+    ) -> List[List[float]]:
+        """Generate embeddings for a list of texts, encoding them in batches"""
+        logger.debug("generate_embeddings, is_query=%s, texts=%s", is_query, len(texts))
+        prefix: str = self.get_prefix(is_query)
+        input_texts: List[str] = [prefix + text for text in texts]
+
+        return await run_in_executor(_encode, input_texts)
+
+
+def _encode(input_texts: List[str]) -> List[List[float]]:
+    """Encode texts with the session loaded in the current process"""
+    session, tokenizer = E5Onnx.get_model()
+    input_names: set[str] = {i.name for i in session.get_inputs()}
+    result: List[List[float]] = []
+
+    for batch_start in range(0, len(input_texts), BATCH_SIZE):
+        inputs: dict = tokenizer(
+            input_texts[batch_start : batch_start + BATCH_SIZE],
+            padding=True,
+            truncation=True,
+            max_length=E5Onnx.MAX_SEQUENCE_LENGTH,
+            return_tensors="np",
+        )
+        inputs = {k: v.astype(np.int64) for k, v in inputs.items() if k in input_names}
+        hidden_state: np.ndarray = session.run(None, inputs)[0]
+
+        # mean pooling over non-padding tokens, then L2 normalization
+        mask: np.ndarray = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+        embeddings: np.ndarray = (hidden_state * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        embeddings /= np.clip(
+            np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+        )
+
+        result += embeddings.tolist()
+
+    return result
@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from os import environ, getpid
+from typing import Any, Callable, Optional
+
+# thread or process
+EMBEDDING_EXECUTOR = environ.get("EMBEDDING_EXECUTOR", "thread").lower()
+EMBEDDING_WORKERS = int(environ.get("EMBEDDING_WORKERS", "1"))
+# torch intra-op threads per worker, 0 keeps torch default
+EMBEDDING_TORCH_THREADS = int(environ.get("EMBEDDING_TORCH_THREADS", "0"))
+
+logger = getLogger(__name__)
+
+_executor: Optional[Executor] = None
+_executor_pid: Optional[int] = None
+
+
+def _init_worker(torch_threads: int):
+    """Executor worker initializer"""
+    if torch_threads > 0:
+        try:
+            import torch
+        except ImportError:
+            # ONNX backend, its threads are set by E5_ONNX_THREADS
+            return
+
+        torch.set_num_threads(torch_threads)
+
+
+def get_executor() -> Executor:
+    """Get embedding executor, created once per process
+
+    In process mode every child loads its own copy of the model on first use
+    """
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != getpid():
+        logger.info(
+            "get_executor, creating executor=%s, workers=%s, torch_threads=%s",
+            EMBEDDING_EXECUTOR,
+            EMBEDDING_WORKERS,
+            EMBEDDING_TORCH_THREADS,
+        )
+
+        match EMBEDDING_EXECUTOR:
+            case "process":
+                _executor = ProcessPoolExecutor(
+                    max_workers=EMBEDDING_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(EMBEDDING_TORCH_THREADS,),
+                )
+            case "thread":
+                _executor = ThreadPoolExecutor(
+                    max_workers=EMBEDDING_WORKERS,
+                    thread_name_prefix="embedding",
+                    initializer=_init_worker,
+                    initargs=(EMBEDDING_TORCH_THREADS,),
+                )
+            case _:
+                raise ValueError(f"Unknown embedding executor: {EMBEDDING_EXECUTOR}")
+
+        _executor_pid = getpid()
+
+    return _executor
+
+
+async def run_in_executor(func: Callable, *args: Any) -> Any:
+    """Run function in embedding executor, keeping the event loop responsive"""
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), partial(func, *args)
+    )
+
+
+def shutdown_executor():
+    """Shutdown embedding executor"""
+    global _executor
+
+    if _executor is not None and _executor_pid == getpid():
+        logger.info("shutdown_executor")
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+    _executor = None
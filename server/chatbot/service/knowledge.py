@@ -1,28 +1,174 @@
+import asyncio
+import hashlib
 import re
 import uuid
-from typing import List, Optional
+from asyncio import AbstractEventLoop
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import accumulate, islice
+from os import environ, getpid
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
 from uuid import UUID
 from logging import getLogger
-from xml.etree.ElementTree import Element
 
 from fastapi_pagination import Page, Params
 
 from chatbot.dto import KnowledgeResult, KnowledgeDocument
 from chatbot.service.util import Language
-from chatbot.service.embedding import factory, BaseEmbeddingModel
+from chatbot.service.embedding import (
+    factory,
+    BaseEmbeddingModel,
+    BaseEmbeddingCache,
+    get_cache,
+    get_cache_key,
+    get_dispatcher,
+    EmbeddingDispatcher,
+)
 from chatbot.service.configuration import get_embedding_model
-from chatbot.knowledge import DocumentCollection
-from xml.etree import ElementTree
-from collections import Counter, defaultdict
-
-# TODO: make configurable, 2000 ~ 500-1000 tokens, 1000 ~ 250-500 tokens
-CHUNK_SIZE_LIMIT_HEAD_TAIL = 201
-CHUNK_SIZE_LIMIT = 512
+from chatbot.knowledge import DocumentCollection, DocumentWriter
+from chatbot.knowledge.collection import DELETE_BATCH_SIZE
+from chatbot.util.aio import buffered
+from chatbot.util.cache import LRUCache
+
+# chunk sizes are measured in embedding model tokens, a chunk with head and tail
+# overlaps is capped to fit into the embedding model window
+CHUNK_SIZE_TOKENS = int(environ.get("CHUNK_SIZE_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+# tokens reserved for special tokens and glue between sentences
+CHUNK_RESERVED_TOKENS = 8
 CHUNK_GLUE = " "
+TOKEN_COUNT_CACHE_SIZE = int(environ.get("TOKEN_COUNT_CACHE_SIZE", "20000"))
+# number of sentences tokenized at once
+SENTENCE_BATCH_SIZE = 256
+# number of documents chunked at once, spaCy pipelines are shared between them
+CHUNKING_WORKERS = int(environ.get("CHUNKING_WORKERS", "1"))
 NAMESPACE = UUID("d2f60322-9f0f-41b5-a36c-c3eab2e75b2e")
+# number of chunks sent to the embedding model at once during ingestion
+EMBEDDING_BATCH_SIZE = int(environ.get("EMBEDDING_BATCH_SIZE", "256"))
+# number of embedding batches buffered between ingestion pipeline stages
+PIPELINE_QUEUE_SIZE = int(environ.get("PIPELINE_QUEUE_SIZE", "2"))
+# number of stored chunks read at once when comparing content hashes
+MANIFEST_PAGE_SIZE = int(environ.get("MANIFEST_PAGE_SIZE", "10000"))
+# number of embeddings of overwritten chunks kept for chunks moved further down
+EMBEDDING_REUSE_WINDOW = int(environ.get("EMBEDDING_REUSE_WINDOW", "1024"))
+QUERY_CACHE_MAX_ITEMS = int(environ.get("QUERY_CACHE_MAX_ITEMS", "1024"))
+QUERY_CACHE_TTL = float(environ.get("QUERY_CACHE_TTL", "3600"))
+# vector or hybrid, hybrid fuses vector search with the lexical index
+SEARCH_MODE = environ.get("SEARCH_MODE", "vector").lower()
+# single-term queries like part numbers, error codes and tag values, answered by the
+# lexical index alone when it finds them; a term has a digit, a separator between
+# word characters or a tag, trailing punctuation of a question doesn't count
+EXACT_QUERY_PATTERN = re.compile(r"^(?=\S*(?:\d|\w[\-_.:/<>]\w|<\w+>))\S+$")
+EXACT_QUERY_TRAILING = ".,;:!?"
 
 logger = getLogger(__name__)
 
+# in-process cache of query embeddings, keyed by (model name, query)
+_query_cache: LRUCache = LRUCache(QUERY_CACHE_MAX_ITEMS, QUERY_CACHE_TTL)
+
+
+class TokenCounter:
+    """Counts tokens with the embedding model tokenizer, caching counts per text"""
+
+    def __init__(self, model: BaseEmbeddingModel):
+        """Constructor"""
+        self.model: BaseEmbeddingModel = model
+        self._cache: LRUCache = LRUCache(TOKEN_COUNT_CACHE_SIZE)
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """Get token counts of texts"""
+        counts: List[Optional[int]] = [self._cache.get(text) for text in texts]
+        missing: List[int] = [i for i, count in enumerate(counts) if count is None]
+
+        if len(missing) > 0:
+            missing_counts: List[int] = self.model.get_token_counts(
+                [texts[i] for i in missing]
+            )
+
+            for i, count in zip(missing, missing_counts):
+                counts[i] = count
+                self._cache.set(texts[i], count)
+
+        return counts
+
+    def __call__(self, text: str) -> int:
+        """Get token count of a text"""
+        return self.count_many([text])[0]
+
+
+_token_counters: dict[str, TokenCounter] = {}
+_chunking_executor: Optional[Executor] = None
+_chunking_executor_pid: Optional[int] = None
+
+
+def get_chunking_executor() -> Executor:
+    """Get chunking executor, created once per process
+
+    Sentence splitting and token counting are CPU bound, they run apart from the
+    event loop and from the embedding executor
+    """
+    global _chunking_executor, _chunking_executor_pid
+
+    if _chunking_executor is None or _chunking_executor_pid != getpid():
+        logger.info("get_chunking_executor, workers=%s", CHUNKING_WORKERS)
+        _chunking_executor = ThreadPoolExecutor(
+            max_workers=CHUNKING_WORKERS, thread_name_prefix="chunking"
+        )
+        _chunking_executor_pid = getpid()
+
+    return _chunking_executor
+
+
+def shutdown_chunking_executor():
+    """Shutdown chunking executor"""
+    global _chunking_executor
+
+    if _chunking_executor is not None and _chunking_executor_pid == getpid():
+        logger.info("shutdown_chunking_executor")
+        _chunking_executor.shutdown(wait=False, cancel_futures=True)
+
+    _chunking_executor = None
+
+
+def _get_token_counter(model_name: str) -> TokenCounter:
+    """Get token counter for the embedding model"""
+    if model_name not in _token_counters:
+        _token_counters[model_name] = TokenCounter(factory.get(model_name))
+
+    return _token_counters[model_name]
+
+
+def _get_chunk_budget(
+    counter: TokenCounter,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+) -> tuple[int, int]:
+    """Get chunk size and overlap in tokens, so that a chunk with head and tail
+    overlaps fits into the embedding model window"""
+    model: BaseEmbeddingModel = counter.model
+    max_tokens: int = (
+        model.MAX_SEQUENCE_LENGTH
+        - CHUNK_RESERVED_TOKENS
+        - counter(model.get_prefix(False))
+    )
+
+    overlap: int = CHUNK_OVERLAP_TOKENS if chunk_overlap is None else chunk_overlap
+    overlap = max(0, min(overlap, max_tokens // 4))
+    size: int = CHUNK_SIZE_TOKENS if chunk_size is None else chunk_size
+    size = max(1, min(size, max_tokens - 2 * overlap))
+
+    logger.debug("_get_chunk_budget, size=%s, overlap=%s", size, overlap)
+
+    return size, overlap
+
 
 async def _get_embedding(model_name: str, is_query: bool, text: str) -> List[float]:
     """Get embedding depending on model"""
@@ -33,13 +179,78 @@ async def _get_embedding(model_name: str, is_query: bool, text: str) -> List[flo
         text[:20] + "...",
     )
 
+    embedding: List[float] = (await _get_embeddings(model_name, is_query, [text]))[0]
+    logger.debug("_get_embedding, embedding=%s", len(embedding))
+
+    return embedding
+
+
+async def _get_embeddings(
+    model_name: str, is_query: bool, texts: List[str]
+) -> List[List[float]]:
+    """Get embeddings for a list of texts depending on model
+
+    Embeddings found in the cache are reused, only the missing ones are generated.
+    Generation goes through the dispatcher, so concurrent callers share batches.
+    """
+    logger.debug(
+        "_get_embeddings, model_name=%s, is_query=%s, texts=%s",
+        model_name,
+        is_query,
+        len(texts),
+    )
+
     model: BaseEmbeddingModel = factory.get(model_name)
-    embedding: List[float] = await model.generate_embedding(is_query, text)
-    logger.debug("_get_embedding, model=%s, embedding=%s", model, len(embedding))
+    dispatcher: EmbeddingDispatcher = get_dispatcher(model_name)
+    cache: Optional[BaseEmbeddingCache] = get_cache()
+
+    if cache is None:
+        return await dispatcher.generate_embeddings(is_query, texts)
+
+    prefix: str = model.get_prefix(is_query)
+    keys: List[str] = [get_cache_key(model_name, prefix, text) for text in texts]
+    embeddings: List[Optional[List[float]]] = await cache.get_many(keys)
+    missing: List[int] = [i for i, e in enumerate(embeddings) if e is None]
+
+    if len(missing) > 0:
+        generated: List[List[float]] = await dispatcher.generate_embeddings(
+            is_query, [texts[i] for i in missing]
+        )
+
+        for i, embedding in zip(missing, generated):
+            embeddings[i] = embedding
+
+        await cache.set_many({keys[i]: embeddings[i] for i in missing})
+
+    logger.debug(
+        "_get_embeddings, model=%s, embeddings=%s, generated=%s",
+        model,
+        len(embeddings),
+        len(missing),
+    )
+
+    return embeddings
+
+
+async def _get_query_embedding(model_name: str, query: str) -> List[float]:
+    """Get query embedding, using in-process cache for repeated queries"""
+    key: tuple[str, str] = (model_name, query)
+    embedding: Optional[List[float]] = _query_cache.get(key)
+
+    if embedding is None:
+        embedding = await _get_embedding(model_name, True, query)
+        _query_cache.set(key, embedding)
+
+    logger.debug("_get_query_embedding, cache=%s", _query_cache.stats)
 
     return embedding
 
 
+def get_query_cache_stats() -> dict[str, int]:
+    """Get query embedding cache statistics: hits, misses, size and max size"""
+    return _query_cache.stats
+
+
 async def get_list(
     collection: DocumentCollection, page: int, size: int
 ) -> Page[KnowledgeResult]:
@@ -85,99 +296,91 @@ async def delete_all(collection: DocumentCollection):
     await collection.drop()
 
 
-def _traverse_xml(node: Element, depth: int, node_depths: defaultdict):
-    node_depths[depth].append(node.tag)
-
-    for child in node:
-        _traverse_xml(child, depth + 1, node_depths)
-
-
-def _find_repeating_xml_node(root: Element, min_repetitions: int = 10) -> Optional[str]:
-    node_depths: defaultdict = defaultdict(list)
-    _traverse_xml(root, 0, node_depths)
-
-    for depth, tags in sorted(node_depths.items()):
-        tag_counter: Counter = Counter(tags)
-
-        for tag, count in tag_counter.most_common():
-            if count >= min_repetitions:
-                logger.debug("_find_repeating_xml_node, tag=%s, count=%s", tag, count)
-                return tag
+def _batched(iterable: Iterable[str], size: int) -> Iterator[list[str]]:
+    """Iterate lists of up to size items"""
+    iterator: Iterator[str] = iter(iterable)
 
-    return None
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
-def _split_xml(document: KnowledgeDocument) -> list[str]:
-    """Split document by XML tags"""
-    logger.debug("_split_xml, document=%s", document)
-    sentences: list[str] = []
-
-    root: Element = ElementTree.fromstring(document.text)
-    repeating_node: str = _find_repeating_xml_node(root)
+def _split_by_words(text: str, limit: int, counter: TokenCounter) -> list[str]:
+    """Split text that is longer than the limit by words"""
+    words: list[str] = text.split(" ")
+    result: list[str] = []
+    current_chunk: list[str] = []
+    current_chunk_size: int = 0
 
-    if repeating_node is None:
-        raise ValueError("Cannot find a repeating node")
+    for word, word_size in zip(words, counter.count_many(words)):
+        if current_chunk_size + word_size > limit and len(current_chunk) > 0:
+            result.append(" ".join(current_chunk))
+            current_chunk = []
+            current_chunk_size = 0
 
-    # Find all nodes with the specified tag
-    nodes = root.findall(".//" + repeating_node)
+        current_chunk.append(word)
+        current_chunk_size += word_size
 
-    # Splitting the file
-    for idx, node in enumerate(nodes):
-        node_string: str = ElementTree.tostring(node, encoding="unicode")
-        sentences.append(node_string)
-        # logger.debug("_split_xml, idx=%s, node=%s", idx, node_string)
+    if len(current_chunk) > 0:
+        result.append(" ".join(current_chunk))
 
-    return sentences
+    return result
 
 
-def _split_long_sentences(sentences: list[str]) -> list[str]:
+def _split_long_sentences(
+    sentences: Iterable[str], limit: int, counter: TokenCounter
+) -> list[str]:
     """Split sentences that are longer than the limit"""
-    logger.debug("_split_long_sentences, sentences=%s", len(sentences))
+    logger.debug("_split_long_sentences, limit=%s", limit)
     result: list[str] = []
 
-    for sentence in sentences:
-        if len(sentence) <= CHUNK_SIZE_LIMIT:
-            result.append(sentence)
-        else:
+    for batch in _batched(sentences, SENTENCE_BATCH_SIZE):
+        for sentence, sentence_size in zip(batch, counter.count_many(batch)):
+            if sentence_size <= limit:
+                result.append(sentence)
+                continue
+
             chunks: list[str] = sentence.split("\n")
             current_chunk: list[str] = []
             current_chunk_size: int = 0
 
-            for chunk in chunks:
-                if current_chunk_size + len(chunk) >= CHUNK_SIZE_LIMIT:
+            for chunk, chunk_size in zip(chunks, counter.count_many(chunks)):
+                if current_chunk_size + chunk_size > limit:
                     if len(current_chunk) > 0:
                         result.append("\n".join(current_chunk))
 
                     current_chunk = []
                     current_chunk_size = 0
 
+                if chunk_size > limit:
+                    result += _split_by_words(chunk, limit, counter)
+                    continue
+
                 current_chunk.append(chunk)
-                current_chunk_size += len(chunk)
+                current_chunk_size += chunk_size
 
             if len(current_chunk) > 0:
-                result.append(" ".join(current_chunk))
+                result.append("\n".join(current_chunk))
+
+    logger.debug("_split_long_sentences, result=%s", len(result))
 
     return result
 
 
-def _split_sentences(document: KnowledgeDocument) -> list[str]:
+def _split_sentences(document: KnowledgeDocument) -> Iterable[str]:
     """Split document by sentences"""
     logger.debug("_split_sentences, document=%s", document)
-    sentences: list[str]
+    sentences: Iterable[str]
 
     match document.type:
-        case "csv":
+        # xml documents have a record per line
+        case "csv" | "xml":
             sentences = list(
                 filter(lambda line: len(line.strip()) > 0, document.text.split("\n"))
             )
 
-        case "xml":
-            sentences = _split_xml(document)
-
         case _:
             language: Language = Language()
             sentences = language.split_sentences(document.text)
-            sentences = _split_long_sentences(sentences)
 
     return sentences
 
@@ -195,78 +398,373 @@ def _clear_text(text: str) -> str:
     return text
 
 
-def _prepare_and_split(document: KnowledgeDocument) -> list[str]:
-    """Prepare text - clear it, and split by chunks"""
-    logger.debug("_prepare_and_split, document=%s", document)
+def _assemble_chunks(
+    sentences: list[str], limit: int, overlap: int, counter: TokenCounter
+) -> list[str]:
+    """Pack sentences into chunks of at most limit tokens, in a single pass
+
+    Every chunk gets a head from the tail of the previous chunk and a tail from the
+    head of the next chunk, of at most overlap tokens each. Overlaps are looked up
+    in precomputed token offsets of sentences.
+    """
+    logger.debug(
+        "_assemble_chunks, sentences=%s, limit=%s, overlap=%s",
+        len(sentences),
+        limit,
+        overlap,
+    )
+
+    sizes: list[int] = counter.count_many(sentences)
+    # offsets[i] is the number of tokens before sentence i
+    offsets: list[int] = [0] + list(accumulate(sizes))
+    # boundaries[k] is the index of the first sentence of chunk k
+    boundaries: list[int] = []
+    chunk_start: int = 0
+
+    for i in range(len(sizes)):
+        # adding a sentence would exceed the limit
+        if i == 0 or offsets[i + 1] - offsets[chunk_start] > limit:
+            boundaries.append(i)
+            chunk_start = i
+
+    boundaries.append(len(sentences))
+    chunk_count: int = len(boundaries) - 1
+    chunks: list[str] = []
+
+    for k in range(chunk_count):
+        start, end = boundaries[k], boundaries[k + 1]
+        parts: list[str] = []
+
+        if chunk_count > 2 and k > 0:
+            # first sentence of the previous chunk that still fits into overlap
+            head_start: int = max(
+                boundaries[k - 1], bisect_left(offsets, offsets[start] - overlap)
+            )
+            parts.append("\n".join(sentences[head_start:start]))
+
+        parts.append(CHUNK_GLUE.join(sentences[start:end]))
+
+        if chunk_count > 2 and k < chunk_count - 1:
+            # sentence after the last one of the next chunk that fits into overlap
+            tail_end: int = min(
+                boundaries[k + 2], bisect_right(offsets, offsets[end] + overlap) - 1
+            )
+            parts.append("\n".join(sentences[end:tail_end]))
+
+        chunks.append(" ".join(part for part in parts if len(part) > 0))
+
+    return chunks
+
+
+def _split_chunks(
+    document: KnowledgeDocument, limit: int, overlap: int, counter: TokenCounter
+) -> list[str]:
+    """Split document by chunks of at most limit tokens, with overlaps"""
+    logger.debug(
+        "_split_chunks, document=%s, limit=%s, overlap=%s", document, limit, overlap
+    )
 
     text: str = document.text
 
-    if len(text) <= CHUNK_SIZE_LIMIT:
+    # a token is never shorter than a character, so short texts can be kept as is
+    if len(text) <= limit:
         return [text]
 
-    sentences: list[str] = _split_sentences(document)
-    chunks: list[str] = []
-    chunk_size: int = 0
-    current_chunk: list[str] = []
+    sentences: list[str] = _split_long_sentences(
+        _split_sentences(document), limit, counter
+    )
 
-    logger.debug("_prepare_and_split, sentences=%s", len(sentences))
+    return _assemble_chunks(sentences, limit, overlap, counter)
 
-    for sentence in sentences:
-        # adding a chunk would exceed the limit
-        if chunk_size + len(sentence) >= CHUNK_SIZE_LIMIT:
-            if len(current_chunk) > 0:
-                chunks.append(CHUNK_GLUE.join(current_chunk))
 
-            current_chunk = []
-            chunk_size = 0
+def generate_id(
+    source_id: str,
+    url: str,
+    title: str,
+    subtitle: str,
+    chunk: int,
+    part: Optional[int] = None,
+) -> UUID:
+    """Generate id from url, part and chunk"""
+    name: str = f"{source_id}/{url}/{title}/{subtitle}/{chunk}"
 
-        current_chunk.append(sentence)
-        chunk_size += len(sentence)
+    if part is not None:
+        name += f"/{part}"
 
-    if len(current_chunk) > 0:
-        chunks.append(CHUNK_GLUE.join(current_chunk))
+    return uuid.uuid3(NAMESPACE, name)
+
+
+def generate_content_hash(text: str, model: str) -> str:
+    """Generate hash of chunk text and the model embedding it"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _chunk_document(
+    source_id: str,
+    source_title: str,
+    document: KnowledgeDocument,
+    model: str,
+    can_split: bool,
+    limit: int,
+    overlap: int,
+) -> list[tuple[str, dict, str]]:
+    """Split document into chunks as (id, metadata, chunk)"""
+    counter: TokenCounter = _get_token_counter(model)
+    document.text = _clear_text(document.text)
+    texts: List[str] = [document.text]
+
+    if can_split:
+        texts = _split_chunks(document, limit, overlap, counter)
+
+    logger.debug("_chunk_document, document=%s, chunks=%s", document, len(texts))
+
+    # metadata values cannot be None
+    document_metadata: dict = {
+        k: v for k, v in document.dict(exclude={"text"}).items() if v is not None
+    }
+    chunks: list[tuple[str, dict, str]] = []
+
+    for i, text in enumerate(texts):
+        metadata: dict = (
+            dict(
+                source_id=source_id,
+                source_title=source_title,
+                chunk=i + 1,
+                total_chunks=len(texts),
+            )
+            | document_metadata
+        )
+        metadata["content_hash"] = generate_content_hash(text, model)
+
+        document_id: UUID = generate_id(
+            source_id,
+            document.url,
+            document.title,
+            document.subtitle,
+            i,
+            document.part,
+        )
+        chunks.append((str(document_id), metadata, text))
 
     return chunks
 
-def chunks_with_overlays(prev: str, cur: str, _next: str) -> str:
-    """Helps to add CHUNK_SIZE_LIMIT_HEAD_TAIL characters to a chunk from the previous and next chunk."""
 
-    def get_overlay(sentences: list[str], _reverse: bool = False) -> str:
-        """
-        Helper function to get the overlay part from a list of sentences.
-        """
-        overlay = []
-        total_length = 0
+async def _chunk_documents(
+    source_id: str,
+    source_title: str,
+    documents: AsyncIterable[KnowledgeDocument],
+    model: str,
+    can_split: bool,
+    chunk_size: Optional[int],
+    chunk_overlap: Optional[int],
+) -> AsyncIterator[tuple[str, dict, str]]:
+    """Iterate document chunks as (id, metadata, chunk)
+
+    Documents are chunked in the chunking executor, so that embedding and writing
+    of earlier chunks go on meanwhile
+    """
+    loop: AbstractEventLoop = asyncio.get_running_loop()
+    executor: Executor = get_chunking_executor()
+    limit, overlap = await loop.run_in_executor(
+        executor,
+        _get_chunk_budget,
+        _get_token_counter(model),
+        chunk_size,
+        chunk_overlap,
+    )
+
+    async for document in documents:
+        chunks: list[tuple[str, dict, str]] = await loop.run_in_executor(
+            executor,
+            partial(
+                _chunk_document,
+                source_id,
+                source_title,
+                document,
+                model,
+                can_split,
+                limit,
+                overlap,
+            ),
+        )
+
+        for chunk in chunks:
+            yield chunk
+
+
+class EmbeddingReuse:
+    """Finds stored embeddings for chunks whose text is already in collection
+
+    A chunk takes the embedding stored under its own id, or under the id of a chunk
+    that had the same text, e.g. before an inserted paragraph moved it. Ids that are
+    going to be overwritten can't be read later, so their embeddings are read right
+    before they are overwritten and kept for a while by content hash. Chunks of
+    another source in the shared manifest, e.g. one indexed from an identical file,
+    are never overwritten and can be read any time.
+    """
+
+    def __init__(
+        self,
+        collection: DocumentCollection,
+        manifest: dict[str, dict],
+        max_kept: int = EMBEDDING_REUSE_WINDOW,
+        shared_manifest: Optional[dict[str, dict]] = None,
+    ):
+        """Constructor"""
+        self.collection: DocumentCollection = collection
+        self.reused: int = 0
+        self._stored_hashes: dict[str, str] = {
+            document_id: metadata.get("content_hash")
+            for document_id, metadata in manifest.items()
+        }
+        self._stored_ids: dict[str, str] = {
+            metadata.get("content_hash"): document_id
+            for document_id, metadata in (shared_manifest or {}).items()
+        } | {
+            content_hash: document_id
+            for document_id, content_hash in self._stored_hashes.items()
+        }
+        self._overwritten: set[str] = set()
+        # chunk id -> stored id to read its embedding from
+        self._sources: dict[str, str] = {}
+        # ids to read before they are overwritten -> their stored content hash
+        self._keep: dict[str, str] = {}
+        self._kept: LRUCache = LRUCache(max_kept)
+
+    def plan(self, document_id: str, content_hash: str):
+        """Register a chunk that is going to be written, in write order"""
+        stored_id: Optional[str] = (
+            document_id
+            if self._stored_hashes.get(document_id) == content_hash
+            else self._stored_ids.get(content_hash)
+        )
+
+        if stored_id is not None and stored_id not in self._overwritten:
+            self._sources[document_id] = stored_id
+
+        stored_hash: Optional[str] = self._stored_hashes.get(document_id)
 
-        sentences_iter = reversed(sentences) if _reverse else sentences
+        if stored_hash is not None and stored_hash != content_hash:
+            self._keep[document_id] = stored_hash
 
-        for sentence in sentences_iter:
-            if sentence != '#_#_#' and total_length + len(sentence) <= CHUNK_SIZE_LIMIT_HEAD_TAIL:
-                total_length += len(sentence)
-                overlay.append(sentence)
+        self._overwritten.add(document_id)
 
-        return '\n'.join(reversed(overlay) if _reverse else overlay)
+    async def get(self, batch: list[tuple[str, dict, str]]) -> dict[str, List[float]]:
+        """Get stored embeddings of a batch of planned chunks by id, before the batch
+        is written"""
+        sources: dict[str, str] = {
+            document_id: self._sources.pop(document_id)
+            for document_id, _, _ in batch
+            if document_id in self._sources
+        }
+        keep: dict[str, str] = {
+            document_id: self._keep.pop(document_id)
+            for document_id, _, _ in batch
+            if document_id in self._keep
+        }
+        ids: list[str] = list(set(sources.values()) | set(keep))
+        stored: dict[str, List[float]] = (
+            await self.collection.get_embeddings(ids) if len(ids) > 0 else {}
+        )
 
-    temp_head = _next.split('\n')
-    temp_tail = prev.split('\n')
+        for document_id, content_hash in keep.items():
+            if document_id in stored:
+                self._kept.set(content_hash, stored[document_id])
 
-    if prev == cur:  # situation when first chunk
-        temp_tail = ['#_#_#']
-    if _next == cur:  # situation when last chunk
-        temp_head = ['#_#_#']
+        result: dict[str, List[float]] = {}
 
-    start = get_overlay(temp_tail, _reverse=True)
-    end = get_overlay(temp_head)
+        for document_id, metadata, _ in batch:
+            embedding: Optional[List[float]] = (
+                stored.get(sources[document_id])
+                if document_id in sources
+                else self._kept.get(metadata["content_hash"])
+            )
 
-    chunk = f"{start} {cur} {end}"
+            if embedding is not None:
+                result[document_id] = embedding
 
-    return chunk
+        self.reused += len(result)
 
-def generate_id(
-    source_id: str, url: str, title: str, subtitle: str, chunk: int
-) -> UUID:
-    """Generate id from url and chunk"""
-    return uuid.uuid3(NAMESPACE, f"{source_id}/{url}/{title}/{subtitle}/{chunk}")
+        return result
+
+
+async def _skip_unchanged(
+    chunks: AsyncIterable[tuple[str, dict, str]],
+    manifest: dict[str, dict],
+    seen: set[str],
+    reuse: EmbeddingReuse,
+) -> AsyncIterator[tuple[str, dict, str]]:
+    """Skip chunks stored with the same metadata, collecting seen ids"""
+    async for document_id, metadata, text in chunks:
+        seen.add(document_id)
+
+        if manifest.get(document_id) != metadata:
+            reuse.plan(document_id, metadata["content_hash"])
+            yield document_id, metadata, text
+
+
+async def _embed_chunks(
+    chunks: AsyncIterable[tuple[str, dict, str]], model: str, reuse: EmbeddingReuse
+) -> AsyncIterator[list[tuple[str, dict, str, List[float]]]]:
+    """Iterate batches of chunks with their embeddings"""
+    batch: list[tuple[str, dict, str]] = []
+
+    async for chunk in chunks:
+        batch.append(chunk)
+
+        if len(batch) >= EMBEDDING_BATCH_SIZE:
+            yield await _embed_batch(batch, model, reuse)
+            batch = []
+
+    if len(batch) > 0:
+        yield await _embed_batch(batch, model, reuse)
+
+
+async def _embed_batch(
+    batch: list[tuple[str, dict, str]], model: str, reuse: EmbeddingReuse
+) -> list[tuple[str, dict, str, List[float]]]:
+    """Get embeddings for a batch of chunks, embedding only texts not stored yet"""
+    embeddings: dict[str, List[float]] = await reuse.get(batch)
+    missing: list[tuple[str, dict, str]] = [
+        chunk for chunk in batch if chunk[0] not in embeddings
+    ]
+    embeddings.update(
+        zip(
+            [document_id for document_id, _, _ in missing],
+            await _get_embeddings(model, False, [text for _, _, text in missing]),
+        )
+    )
+
+    return [chunk + (embeddings[chunk[0]],) for chunk in batch]
+
+
+async def _get_manifest(
+    collection: DocumentCollection, source_id: str
+) -> dict[str, dict]:
+    """Get metadata of source chunks stored in collection by id"""
+    manifest: dict[str, dict] = {}
+    offset: int = 0
+
+    while True:
+        metadatas: dict[str, dict] = await collection.get_metadatas(
+            dict(source_id=source_id), MANIFEST_PAGE_SIZE, offset
+        )
+        manifest |= metadatas
+
+        if len(metadatas) < MANIFEST_PAGE_SIZE:
+            return manifest
+
+        offset += MANIFEST_PAGE_SIZE
+
+
+async def _delete_ids(collection: DocumentCollection, ids: list[str]):
+    """Delete documents from collection in batches"""
+    for batch in _batched(ids, DELETE_BATCH_SIZE):
+        await collection.delete(batch)
+
+
+async def _single(document: KnowledgeDocument) -> AsyncIterator[KnowledgeDocument]:
+    yield document
 
 
 async def create(
@@ -274,8 +772,16 @@ async def create(
     source_title: str,
     document: KnowledgeDocument,
     can_split: bool = True,
+    writer: Optional[DocumentWriter] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
 ):
-    """Create document in collection"""
+    """Create document in collection
+
+    Chunks are written through the given writer, which lets the caller batch
+    upserts across documents. Without a writer, chunks are flushed per document.
+    Chunk size and overlap are in embedding model tokens.
+    """
     logger.debug(
         "create, source_id=%s, source_title=%s, document=%s, can_split=%s",
         source_id,
@@ -284,65 +790,202 @@ async def create(
         can_split,
     )
 
-    collection: DocumentCollection = DocumentCollection()
-    document.text = _clear_text(document.text)
-    chunks: List[str] = [document.text]
+    await create_many(
+        source_id,
+        source_title,
+        _single(document),
+        can_split,
+        writer,
+        chunk_size,
+        chunk_overlap,
+    )
 
-    if can_split:
-        chunks = _prepare_and_split(document)
 
-    logger.debug("create, got chunks=%s", len(chunks))
-    model: str = await get_embedding_model()
+async def create_many(
+    source_id: str,
+    source_title: str,
+    documents: AsyncIterable[KnowledgeDocument],
+    can_split: bool = True,
+    writer: Optional[DocumentWriter] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    incremental: bool = False,
+    reuse_source_id: Optional[str] = None,
+) -> int:
+    """Create documents in collection, returns the number of documents
+
+    Chunking, embedding and writing run as concurrent stages connected by bounded
+    queues, so documents are consumed lazily while earlier ones are embedded and
+    written. In incremental mode the documents are the complete content of the
+    source: unchanged chunks are not embedded again and chunks that are gone are
+    deleted. Chunks with the same text as a chunk of the reused source take its
+    stored embedding.
+    """
+    logger.debug(
+        "create_many, source_id=%s, source_title=%s, can_split=%s, incremental=%s",
+        source_id,
+        source_title,
+        can_split,
+        incremental,
+    )
 
-    for i, chunk in enumerate(chunks):
-        if len(chunks) > 2:
-            prev_chunk = chunks[i - 1] if i > 0 else chunk
-            next_chunk = chunks[i + 1] if i < len(chunks) - 1 else chunk
-            chunk = chunks_with_overlays(prev_chunk, chunk, next_chunk)
+    if writer is None:
+        async with DocumentWriter(DocumentCollection()) as document_writer:
+            return await create_many(
+                source_id,
+                source_title,
+                documents,
+                can_split,
+                document_writer,
+                chunk_size,
+                chunk_overlap,
+                incremental,
+                reuse_source_id,
+            )
 
+    model: str = await get_embedding_model()
+    document_count: int = 0
+    written: int = 0
+    manifest: dict[str, dict] = {}
+    shared_manifest: dict[str, dict] = {}
+    seen: set[str] = set()
+
+    if incremental:
+        manifest = await _get_manifest(writer.collection, source_id)
+        logger.debug("create_many, manifest=%s", len(manifest))
+
+    if reuse_source_id is not None:
+        shared_manifest = await _get_manifest(writer.collection, reuse_source_id)
         logger.debug(
-            "create, source_id=%s, i=%s, chunk=%s", source_id, i, chunk[:20] + "..."
+            "create_many, reuse_source_id=%s, shared_manifest=%s",
+            reuse_source_id,
+            len(shared_manifest),
         )
 
-        metadata: dict[str, str] = dict(
-            source_id=source_id,
-            source_title=source_title,
-            chunk=i + 1,
-            total_chunks=len(chunks),
-        )
+    reuse: EmbeddingReuse = EmbeddingReuse(
+        writer.collection, manifest, shared_manifest=shared_manifest
+    )
 
-        document_id: UUID = generate_id(
-            source_id, document.url, document.title, document.subtitle, i
+    async def count_documents(
+        items: AsyncIterable[KnowledgeDocument],
+    ) -> AsyncIterator[KnowledgeDocument]:
+        nonlocal document_count
+
+        async for document in items:
+            document_count += 1
+            yield document
+
+    chunks: AsyncIterator[tuple[str, dict, str]] = _skip_unchanged(
+        _chunk_documents(
+            source_id,
+            source_title,
+            count_documents(documents),
+            model,
+            can_split,
+            chunk_size,
+            chunk_overlap,
+        ),
+        manifest,
+        seen,
+        reuse,
+    )
+    chunks = buffered(chunks, PIPELINE_QUEUE_SIZE * EMBEDDING_BATCH_SIZE)
+
+    async for batch in buffered(
+        _embed_chunks(chunks, model, reuse), PIPELINE_QUEUE_SIZE
+    ):
+        for document_id, metadata, chunk, embedding in batch:
+            logger.debug(
+                "create_many, source_id=%s, chunk=%s, text=%s",
+                source_id,
+                metadata["chunk"],
+                chunk[:20] + "...",
+            )
+
+            await writer.add(document_id, embedding, metadata, chunk)
+            written += 1
+
+    if incremental:
+        stale_ids: list[str] = [i for i in manifest if i not in seen]
+        logger.info(
+            "create_many, source_id=%s, chunks=%s, unchanged=%s, reused=%s, "
+            "stale=%s",
+            source_id,
+            len(seen),
+            len(seen) - written,
+            reuse.reused,
+            len(stale_ids),
         )
 
-        # metadata values cannot be None
-        metadata |= {
-            k: v for k, v in document.dict(exclude={"text"}).items() if v is not None
-        }
+        # written chunks must not be deleted after a failed flush
+        await writer.flush()
+        await _delete_ids(writer.collection, stale_ids)
 
-        await collection.upsert(
-            ids=[str(document_id)],
-            embeddings=[await _get_embedding(model, False, chunk)],
-            metadatas=[metadata],
-            documents=[chunk],
-        )
+    return document_count
 
 
 async def search(
-    query: str, limit: int, metadata_filter: Optional[dict] = None
+    query: str,
+    limit: int,
+    metadata_filter: Optional[dict] = None,
+    mode: Optional[str] = None,
 ) -> List[KnowledgeResult]:
-    """Search documents in collection"""
+    """Search documents in collection, mode is vector or hybrid, SEARCH_MODE if not
+    set"""
+    mode = mode or SEARCH_MODE
     logger.debug(
-        "search, query=%s, limit=%s, metadata_filter=%s", query, limit, metadata_filter
+        "search, query=%s, limit=%s, metadata_filter=%s, mode=%s",
+        query,
+        limit,
+        metadata_filter,
+        mode,
     )
 
     collection: DocumentCollection = DocumentCollection()
+    result: List[KnowledgeResult]
+
+    if mode == "hybrid" and EXACT_QUERY_PATTERN.match(
+        query.strip().rstrip(EXACT_QUERY_TRAILING)
+    ):
+        result = await collection.query_text(query, limit, metadata_filter)
+
+        if len(result) > 0:
+            logger.debug("search, exact match, found items=%s", len(result))
+            return result
+
     model: str = await get_embedding_model()
+    embedding: List[float] = await _get_query_embedding(model, query)
+
+    match mode:
+        case "vector":
+            result = await collection.query_embeddings(
+                embedding, limit, metadata_filter
+            )
+        case "hybrid":
+            result = await collection.query_hybrid(
+                query, embedding, limit, metadata_filter
+            )
+        case _:
+            raise ValueError(f"Unknown search mode: {mode}")
 
-    embedding: List[float] = await _get_embedding(model, True, query)
-    result: List[KnowledgeResult] = await collection.query_embeddings(
-        embedding, limit, metadata_filter
-    )
     logger.debug("search, found items=%s", len(result))
 
     return result
+
+
+async def rebuild_lexical_index() -> int:
+    """Index all documents of collection in lexical index, returns their number"""
+    logger.debug("rebuild_lexical_index")
+
+    return await DocumentCollection().rebuild_lexical_index()
+
+
+async def is_lexical_index_missing() -> bool:
+    """Check if lexical index is enabled and empty while collection is not"""
+    collection: DocumentCollection = DocumentCollection()
+
+    return (
+        collection.lexical is not None
+        and await collection.lexical.count() == 0
+        and await collection.count() > 0
+    )
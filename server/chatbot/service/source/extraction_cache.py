@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import time
+from logging import getLogger
+from os import environ, path, makedirs, remove, replace, walk, stat, utime
+from typing import AsyncIterable, AsyncIterator, IO, Optional
+
+from chatbot.dto import KnowledgeDocument
+from chatbot.util.aio import make_async
+
+EXTRACTION_CACHE = environ.get("EXTRACTION_CACHE", "true").lower() == "true"
+EXTRACTION_CACHE_PATH = environ.get(
+    "EXTRACTION_CACHE_PATH",
+    path.join(environ.get("FILE_STORAGE_PATH", "/tmp"), "extracted"),
+)
+# seconds since last use
+EXTRACTION_CACHE_TTL = int(environ.get("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+EXTRACTION_CACHE_COMPRESSION = int(environ.get("EXTRACTION_CACHE_COMPRESSION", "6"))
+# number of documents read from cache at once
+READ_BATCH_SIZE = 16
+
+logger = getLogger(__name__)
+
+
+def get_key(file_hash: str, version: str) -> str:
+    """Get cache key of file extracted with the given extractor version"""
+    return hashlib.sha256(f"{file_hash}/{version}".encode("utf-8")).hexdigest()
+
+
+def _get_cache_path(key: str) -> str:
+    return path.join(EXTRACTION_CACHE_PATH, key[:2], f"{key}.jsonl.gz")
+
+
+@make_async
+def _open(file_path: str, mode: str) -> IO:
+    if "w" in mode:
+        makedirs(path.dirname(file_path), exist_ok=True)
+
+    return gzip.open(
+        file_path, mode, encoding="utf-8", compresslevel=EXTRACTION_CACHE_COMPRESSION
+    )
+
+
+def _remove_title(document: KnowledgeDocument, title: str) -> KnowledgeDocument:
+    """Remove source title from document, cached documents don't depend on it"""
+    url: Optional[str] = document.url
+
+    if url is not None and url.startswith(title):
+        url = url[len(title) :]
+
+    return document.copy(
+        update=dict(title="" if document.title == title else document.title, url=url)
+    )
+
+
+def _add_title(document: KnowledgeDocument, title: str) -> KnowledgeDocument:
+    """Add source title to cached document"""
+    if document.title == "":
+        document.title = title
+
+    if document.url is not None:
+        document.url = title + document.url
+
+    return document
+
+
+@make_async
+def _read(cache_file: IO, count: int, title: str) -> list[KnowledgeDocument]:
+    documents: list[KnowledgeDocument] = []
+
+    for line in cache_file:
+        documents.append(_add_title(KnowledgeDocument.parse_raw(line), title))
+
+        if len(documents) >= count:
+            break
+
+    return documents
+
+
+@make_async
+def _write(cache_file: IO, document: KnowledgeDocument, title: str):
+    cache_file.write(_remove_title(document, title).json() + "\n")
+
+
+@make_async
+def _close(cache_file: IO, file_path: Optional[str] = None):
+    """Close cache file, moving it to the given path"""
+    cache_file.close()
+
+    if file_path is not None:
+        replace(cache_file.name, file_path)
+
+
+async def cached(
+    key: str, title: str, documents: AsyncIterable[KnowledgeDocument]
+) -> AsyncIterator[KnowledgeDocument]:
+    """Iterate cached documents, or the given documents while caching them
+
+    Documents are cached only when they are iterated completely. They are cached
+    without the source title, which can change, so urls of the documents must start
+    with the title, as urls of extracted files do.
+    """
+    cache_path: str = _get_cache_path(key)
+
+    if path.exists(cache_path):
+        logger.info("cached, key=%s, hit", key)
+        utime(cache_path)
+        cache_file: IO = await _open(cache_path, "rt")
+
+        try:
+            while batch := await _read(cache_file, READ_BATCH_SIZE, title):
+                for document in batch:
+                    yield document
+
+        finally:
+            await _close(cache_file)
+
+        return
+
+    logger.info("cached, key=%s, miss", key)
+    cache_file = await _open(f"{cache_path}.{time.time_ns()}.tmp", "wt")
+
+    try:
+        async for document in documents:
+            await _write(cache_file, document, title)
+            yield document
+
+    except BaseException:
+        await _close(cache_file)
+        remove(cache_file.name)
+        raise
+
+    await _close(cache_file, cache_path)
+
+
+@make_async
+def collect_garbage() -> int:
+    """Remove cached documents older than TTL, returns number of removed files"""
+    expired_at: float = time.time() - EXTRACTION_CACHE_TTL
+    removed: int = 0
+
+    for root, _, file_names in walk(EXTRACTION_CACHE_PATH):
+        for file_name in file_names:
+            file_path: str = path.join(root, file_name)
+
+            if stat(file_path).st_mtime < expired_at:
+                remove(file_path)
+                removed += 1
+
+    logger.info("collect_garbage, removed=%s", removed)
+
+    return removed
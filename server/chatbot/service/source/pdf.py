@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from logging import getLogger
+from os import environ, getpid, cpu_count
+from typing import Optional
+
+from chatbot.util.pdf_worker import extract_pages, get_page_count
+
+PDF_WORKERS = int(environ.get("PDF_WORKERS", str(min(4, cpu_count() or 1))))
+# number of pages extracted by a single task
+PDF_PAGES_PER_TASK = int(environ.get("PDF_PAGES_PER_TASK", "50"))
+# seconds, 0 disables timeout
+PDF_PAGE_TIMEOUT = float(environ.get("PDF_PAGE_TIMEOUT", "30"))
+
+logger = getLogger(__name__)
+
+_executor: Optional[Executor] = None
+_executor_pid: Optional[int] = None
+
+
+def get_executor() -> Executor:
+    """Get pdf extraction executor, created once per process"""
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != getpid():
+        logger.info("get_executor, workers=%s", PDF_WORKERS)
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        _executor_pid = getpid()
+
+    return _executor
+
+
+def shutdown_executor():
+    """Shutdown pdf extraction executor"""
+    global _executor
+
+    if _executor is not None and _executor_pid == getpid():
+        logger.info("shutdown_executor")
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+    _executor = None
+
+
+async def extract_text(file_path: str) -> str:
+    """Extract text from pdf file, page ranges are extracted in parallel"""
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    executor: Executor = get_executor()
+    page_count: int = await loop.run_in_executor(
+        executor, partial(get_page_count, file_path)
+    )
+    logger.debug("extract_text, file_path=%s, pages=%s", file_path, page_count)
+
+    page_ranges: list[list[str]] = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor,
+                partial(
+                    extract_pages,
+                    file_path,
+                    start,
+                    min(start + PDF_PAGES_PER_TASK, page_count),
+                    PDF_PAGE_TIMEOUT,
+                ),
+            )
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ]
+    )
+
+    return "".join(page_text for page_texts in page_ranges for page_text in page_texts)
@@ -9,7 +9,14 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from chatbot.db.connection import get_db
 from chatbot.db.model import Source, SourceProgress, SourceStatus, SourceType
-from chatbot.dto import SourceConfiguration, JiraConfiguration, ConfluenceConfiguration
+from chatbot.knowledge import DocumentCollection
+from chatbot.dto import (
+    SourceConfiguration,
+    UploadConfiguration,
+    JiraConfiguration,
+    ConfluenceConfiguration,
+)
+from . import extraction_cache, storage
 from .upload import save_file, index as index_upload
 
 logger = getLogger(__name__)
@@ -28,8 +35,11 @@ async def get(db: AsyncSession, source_id: UUID) -> Source:
 def parse_configuration(type: SourceType, source_configuration: dict) -> SourceConfiguration:
     """Parse configuration"""
     configuration: Optional[SourceConfiguration] = None
+    source_configuration = source_configuration or {}
 
     match type:
+        case SourceType.UPLOAD:
+            configuration = UploadConfiguration(**source_configuration)
         case SourceType.CONFLUENCE:
             configuration = ConfluenceConfiguration(**source_configuration)
         case SourceType.JIRA:
@@ -65,6 +75,10 @@ async def create(db: AsyncSession, title: str, description: Optional[str],
 
 async def upload(db: AsyncSession, source: Source, uploaded_file: UploadFile) -> Source:
     """Upload file"""
+    # sources indexed before files were kept have no progress anymore
+    if source.progress is None:
+        source.progress = SourceProgress(id=uuid.uuid4())
+
     return await save_file(db, source, uploaded_file)
 
 
@@ -95,6 +109,70 @@ async def delete(db: AsyncSession, source_id: UUID):
     await db.commit()
 
 
+async def delete_documents(source_id: UUID) -> int:
+    """Delete source documents from vector storage"""
+    logger.info("delete_documents, source_id=%s", source_id)
+    return await DocumentCollection().delete_by_source(str(source_id))
+
+
+async def sweep_orphan_documents() -> int:
+    """Delete documents of sources that don't exist anymore"""
+    # sources are read after documents, so that sources created meanwhile are kept
+    collection: DocumentCollection = DocumentCollection()
+    document_source_ids: set[str] = await collection.get_source_ids()
+    db: AsyncSession = await anext(get_db())
+
+    try:
+        source_ids: set[str] = set(map(str, await db.scalars(select(Source.id))))
+    finally:
+        await db.close()
+
+    orphan_source_ids: set[str] = document_source_ids - source_ids
+    deleted: int = 0
+    logger.info("sweep_orphan_documents, orphan_sources=%s", len(orphan_source_ids))
+
+    for source_id in orphan_source_ids:
+        deleted += await collection.delete_by_source(source_id)
+
+    return deleted
+
+
+async def collect_unused_files() -> int:
+    """Remove stored files that are not referenced by sources and expired cache"""
+    db: AsyncSession = await anext(get_db())
+
+    try:
+        referenced_hashes: set[str] = set(await db.scalars(
+            select(SourceProgress.file_hash)
+            .where(SourceProgress.file_hash.is_not(None))
+            .distinct()
+        ))
+    finally:
+        await db.close()
+
+    return (
+        await storage.collect_garbage(referenced_hashes)
+        + await extraction_cache.collect_garbage()
+    )
+
+
+async def _get_indexed_source_id(db: AsyncSession, source: Source) -> Optional[str]:
+    """Get id of another indexed upload source with the same file"""
+    if source.progress is None or source.progress.file_hash is None:
+        return None
+
+    source_id: Optional[UUID] = await db.scalar(
+        select(Source.id)
+        .join(SourceProgress)
+        .where(SourceProgress.file_hash == source.progress.file_hash)
+        .where(Source.id != source.id)
+        .where(Source.status == SourceStatus.FINISHED)
+        .limit(1)
+    )
+
+    return str(source_id) if source_id is not None else None
+
+
 async def _set_status(db: AsyncSession, source: Source, status: SourceStatus, status_text: Optional[str] = None):
     """Set source status"""
     source.status = status
@@ -127,14 +205,26 @@ async def index(source_id: UUID, reindex: Optional[bool] = False):
             raise Exception("Source cannot be indexed")
 
         source = await _set_status(db, source, SourceStatus.INDEXING)
+
+        # reindexing is incremental, chunks that are gone are deleted by indexing
         document_count: int = 0
 
+        configuration: SourceConfiguration = parse_configuration(
+            source.type, source.configuration
+        )
+
         match source.type:
             case SourceType.UPLOAD:
-                document_count = await index_upload(source)
+                # identical file uploaded to another source, its embeddings are reused
+                reuse_source_id: Optional[str] = await _get_indexed_source_id(db, source)
+                logger.info("index, source_id=%s, reuse_source_id=%s", source_id, reuse_source_id)
+                document_count = await index_upload(source, configuration, reuse_source_id)
 
         source.document_count = document_count
-        del source.progress
+
+        # upload sources keep the stored file for reindexing and re-uploads
+        if source.type != SourceType.UPLOAD:
+            del source.progress
 
         await _set_status(db, source, SourceStatus.FINISHED)
 
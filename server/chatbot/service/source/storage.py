@@ -0,0 +1,70 @@
+import time
+from logging import getLogger
+from os import environ, path, makedirs, remove, walk, stat, utime
+from shutil import move
+
+from chatbot.util.aio import make_async
+
+BLOB_STORAGE_PATH = environ.get(
+    "BLOB_STORAGE_PATH",
+    path.join(environ.get("FILE_STORAGE_PATH", "/tmp"), "blobs"),
+)
+# seconds, unreferenced files younger than this are kept for uploads in progress
+BLOB_GC_GRACE_PERIOD = int(environ.get("BLOB_GC_GRACE_PERIOD", "3600"))
+
+logger = getLogger(__name__)
+
+
+def get_file_path(file_hash: str, extension: str) -> str:
+    """Get path of stored file by content hash"""
+    return path.join(
+        BLOB_STORAGE_PATH, file_hash[:2], file_hash[2:4], f"{file_hash}.{extension}"
+    )
+
+
+@make_async
+def store(file_path: str, file_hash: str, extension: str) -> str:
+    """Move file to content-addressed storage, returns stored file path
+
+    Identical files are stored once, a duplicate is removed.
+    """
+    stored_file_path: str = get_file_path(file_hash, extension)
+
+    if path.exists(stored_file_path):
+        logger.debug("store, file_hash=%s already stored", file_hash)
+        remove(file_path)
+        # keep the file from garbage collection until it's referenced
+        utime(stored_file_path)
+
+        return stored_file_path
+
+    makedirs(path.dirname(stored_file_path), exist_ok=True)
+    move(file_path, stored_file_path)
+    logger.debug("store, file_hash=%s, path=%s", file_hash, stored_file_path)
+
+    return stored_file_path
+
+
+@make_async
+def collect_garbage(referenced_hashes: set[str]) -> int:
+    """Remove stored files that are not referenced, returns number of removed files"""
+    logger.info("collect_garbage, referenced=%s", len(referenced_hashes))
+    expired_at: float = time.time() - BLOB_GC_GRACE_PERIOD
+    removed: int = 0
+
+    for root, _, file_names in walk(BLOB_STORAGE_PATH):
+        for file_name in file_names:
+            file_path: str = path.join(root, file_name)
+
+            if (
+                file_name.split(".")[0] in referenced_hashes
+                or stat(file_path).st_mtime > expired_at
+            ):
+                continue
+
+            remove(file_path)
+            removed += 1
+
+    logger.info("collect_garbage, removed=%s", removed)
+
+    return removed
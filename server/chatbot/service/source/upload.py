@@ -1,24 +1,51 @@
 import csv
+import hashlib
 from datetime import datetime
-from io import StringIO
+from io import StringIO, TextIOWrapper
 from logging import getLogger
-from os import walk, path, environ
-from zipfile import ZipFile
+from os import path, environ
+from shutil import copyfileobj
+from itertools import islice
+from typing import IO, AsyncIterator, Iterator, Optional
+from zipfile import ZipFile, ZipInfo
 
 import aiofiles
+import aiofiles.os
 import docx2txt
-import pdfplumber
 from fastapi import UploadFile
 from openpyxl import Workbook, load_workbook
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from chatbot.db.model.source import Source
-from chatbot.dto import KnowledgeDocument
+from chatbot.dto import KnowledgeDocument, SourceConfiguration
+from chatbot.knowledge import DocumentCollection, DocumentWriter
 from chatbot.service import knowledge as knowledge_service
+from chatbot.util.aio import make_async, buffered, merge
+from chatbot.util.xml_records import find_repeating_node, iter_records
+from . import extraction_cache, storage
+from .pdf import extract_text as extract_pdf_text
 
 FILE_STORAGE_PATH = environ.get("FILE_STORAGE_PATH", "/tmp")
-FILE_READ_CHUNK = 1024
-ALLOWED_FILE_EXTENSIONS = ["txt", "csv", "md", "pdf", "docx", "xlsx", "zip", "xml"]
+# increment when extracted documents change, to invalidate extraction cache
+EXTRACTOR_VERSION = 2
+UPLOAD_BUFFER_SIZE = int(environ.get("UPLOAD_BUFFER_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(environ.get("MAX_UPLOAD_SIZE", str(2 * 1024 * 1024 * 1024)))
+# number of extracted documents buffered ahead of chunking
+EXTRACTION_QUEUE_SIZE = int(environ.get("EXTRACTION_QUEUE_SIZE", "4"))
+# number of spreadsheet rows in a single document
+XLSX_ROWS_PER_DOCUMENT = int(environ.get("XLSX_ROWS_PER_DOCUMENT", "1000"))
+# large xml files are split into documents of this many records
+XML_RECORDS_PER_DOCUMENT = int(environ.get("XML_RECORDS_PER_DOCUMENT", "1000"))
+# number of XML elements scanned to find the repeating node
+XML_SCAN_EVENTS = int(environ.get("XML_SCAN_EVENTS", "100000"))
+TEXT_FILE_EXTENSIONS = ["txt", "csv", "md"]
+ALLOWED_FILE_EXTENSIONS = TEXT_FILE_EXTENSIONS + ["xml", "pdf", "docx", "xlsx", "zip"]
+# number of archive members extracted at once
+ZIP_WORKERS = int(environ.get("ZIP_WORKERS", "4"))
+ZIP_MAX_MEMBERS = int(environ.get("ZIP_MAX_MEMBERS", "10000"))
+# total uncompressed size of extracted members, bytes
+ZIP_MAX_SIZE = int(environ.get("ZIP_MAX_SIZE", str(4 * 1024 * 1024 * 1024)))
+ZIP_COPY_BUFFER = 1024 * 1024
 
 logger = getLogger(__name__)
 
@@ -26,19 +53,44 @@ logger = getLogger(__name__)
 async def save_file(
     db: AsyncSession, source: Source, uploaded_file: UploadFile
 ) -> Source:
-    """Save uploaded file"""
+    """Save uploaded file to content-addressed storage
+
+    Identical files are stored once, an identical re-upload keeps the source as is.
+    """
     logger.debug("save_file, source=%s, uploaded_file=%s", source, uploaded_file)
     extension: str = uploaded_file.filename.split(".")[-1]
+    file_hash = hashlib.sha256()
+    file_size: int = 0
 
     async with aiofiles.tempfile.NamedTemporaryFile(
         "w+b", dir=FILE_STORAGE_PATH, delete=False, suffix=f".{extension}"
     ) as out_file:
-        while content := await uploaded_file.read(FILE_READ_CHUNK):
-            await out_file.write(content)
+        try:
+            while content := await uploaded_file.read(UPLOAD_BUFFER_SIZE):
+                file_size += len(content)
+
+                if file_size > MAX_UPLOAD_SIZE:
+                    raise ValueError(f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+
+                file_hash.update(content)
+                await out_file.write(content)
+
+        except BaseException:
+            await aiofiles.os.remove(out_file.name)
+            raise
+
+    if source.progress.file_hash == file_hash.hexdigest():
+        logger.info("save_file, file is identical to previous upload")
+        await aiofiles.os.remove(out_file.name)
 
-        source.progress.temporary_file_path = out_file.name
-        source.updated_by = "admin"
-        source.updated_at = datetime.now()
+        return source
+
+    source.progress.temporary_file_path = await storage.store(
+        out_file.name, file_hash.hexdigest(), extension
+    )
+    source.progress.file_hash = file_hash.hexdigest()
+    source.updated_by = "admin"
+    source.updated_at = datetime.now()
 
     await db.commit()
     await db.refresh(source)
@@ -46,9 +98,45 @@ async def save_file(
     return source
 
 
+@make_async
+def _read_txt(file_path: str) -> str:
+    """Read text file"""
+    with open(file_path, "rt", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+@make_async
+def _read_docx(file_path: str) -> str:
+    """Read text of docx file"""
+    return docx2txt.process(file_path)
+
+
+@make_async
+def _load_xlsx(file_path: str) -> Workbook:
+    """Load xlsx workbook in read-only mode, cells are read lazily"""
+    return load_workbook(file_path, read_only=True, data_only=True)
+
+
+@make_async
+def _read_rows(rows: Iterator[tuple], count: int) -> Optional[str]:
+    """Read up to count rows as csv, None when there are no rows left"""
+    csv_output = StringIO()
+    writer = csv.writer(csv_output)
+    row_count: int = 0
+
+    for row in islice(rows, count):
+        writer.writerow(row)
+        row_count += 1
+
+    if row_count == 0:
+        return None
+
+    return csv_output.getvalue()
+
+
 async def _extract_from_txt(
     file_name: str, file_path: str, url: str, extension: str
-) -> list[KnowledgeDocument]:
+) -> AsyncIterator[KnowledgeDocument]:
     """Extract text from text file"""
     logger.debug(
         "_extract_from_txt, file_name=%s, file_path=%s, url=%s, extension=%s",
@@ -58,40 +146,95 @@ async def _extract_from_txt(
         extension,
     )
 
-    with open(file_path, "rt", encoding="utf-8", errors="ignore") as f:
-        text = f.read()
+    text: str = await _read_txt(file_path)
 
     if text is None:
         raise RuntimeError("text is empty")
 
-    return [KnowledgeDocument(title=file_name, type=extension, text=text, url=url)]
+    yield KnowledgeDocument(title=file_name, type=extension, text=text, url=url)
 
 
-async def _extract_from_pdf(
+@make_async
+def _open_xml(file_path: str) -> tuple[IO, Optional[Iterator[str]]]:
+    """Open xml file with an iterator of its records, None when there are no
+    repeating records"""
+    xml_file: IO = open(file_path, "rb")
+    tag: Optional[str] = find_repeating_node(xml_file, max_events=XML_SCAN_EVENTS)
+    xml_file.seek(0)
+
+    return xml_file, iter_records(xml_file, tag) if tag is not None else None
+
+
+@make_async
+def _read_records(records: Iterator[str], count: int) -> Optional[str]:
+    """Read up to count records, a record per line, None when there are no records
+    left"""
+    lines: list[str] = [" ".join(record.split()) for record in islice(records, count)]
+
+    return "\n".join(lines) if len(lines) > 0 else None
+
+
+async def _extract_from_xml(
     file_name: str, file_path: str, url: str
-) -> list[KnowledgeDocument]:
-    """Extract text from pdf file"""
+) -> AsyncIterator[KnowledgeDocument]:
+    """Extract records from xml file
+
+    The file is parsed incrementally, records are yielded in documents of
+    XML_RECORDS_PER_DOCUMENT records, a record per line, so that large files are
+    kept out of memory
+    """
     logger.debug(
-        "_extract_from_pdf, file_name=%s, file_path=%s, url=%s",
+        "_extract_from_xml, file_name=%s, file_path=%s, url=%s",
         file_name,
         file_path,
         url,
     )
-    file_text: str = ""
+    xml_file, records = await _open_xml(file_path)
 
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text(x_tolerance=1)
+    try:
+        if records is None:
+            # without repeating records the file is split by lines
+            yield KnowledgeDocument(
+                title=file_name, type="xml", text=await _read_txt(file_path), url=url
+            )
+            return
+
+        part: int = 0
 
-            if page_text is not None:
-                file_text += page_text
+        while (
+            text := await _read_records(records, XML_RECORDS_PER_DOCUMENT)
+        ) is not None:
+            yield KnowledgeDocument(
+                title=file_name,
+                type="xml",
+                text=text,
+                url=url,
+                part=part if part > 0 else None,
+            )
+            part += 1
 
-    return [KnowledgeDocument(title=file_name, type="pdf", text=file_text, url=url)]
+    finally:
+        xml_file.close()
+
+
+async def _extract_from_pdf(
+    file_name: str, file_path: str, url: str
+) -> AsyncIterator[KnowledgeDocument]:
+    """Extract text from pdf file"""
+    logger.debug(
+        "_extract_from_pdf, file_name=%s, file_path=%s, url=%s",
+        file_name,
+        file_path,
+        url,
+    )
+    yield KnowledgeDocument(
+        title=file_name, type="pdf", text=await extract_pdf_text(file_path), url=url
+    )
 
 
 async def _extract_from_docx(
     file_name: str, file_path: str, url: str
-) -> list[KnowledgeDocument]:
+) -> AsyncIterator[KnowledgeDocument]:
     """Extract text from docx file"""
     logger.debug(
         "_extract_from_docx, file_name=%s, file_path=%s, url=%s",
@@ -99,16 +242,14 @@ async def _extract_from_docx(
         file_path,
         url,
     )
-    return [
-        KnowledgeDocument(
-            title=file_name, type="docx", text=docx2txt.process(file_path), url=url
-        )
-    ]
+    yield KnowledgeDocument(
+        title=file_name, type="docx", text=await _read_docx(file_path), url=url
+    )
 
 
 async def _extract_from_xlsx(
     file_name: str, file_path: str, url: str
-) -> list[KnowledgeDocument]:
+) -> AsyncIterator[KnowledgeDocument]:
     """Extract text from xlsx file"""
     logger.debug(
         "_extract_from_xlsx, file_name=%s, file_path=%s, url=%s",
@@ -116,88 +257,135 @@ async def _extract_from_xlsx(
         file_path,
         url,
     )
-    workbook: Workbook = load_workbook(file_path)
-    result: list[KnowledgeDocument] = []
+    workbook: Workbook = await _load_xlsx(file_path)
+
+    try:
+        for worksheet in workbook:
+            rows: Iterator[tuple] = worksheet.iter_rows(values_only=True)
+            part: int = 0
+
+            while (text := await _read_rows(rows, XLSX_ROWS_PER_DOCUMENT)) is not None:
+                yield KnowledgeDocument(
+                    title=file_name,
+                    subtitle=worksheet.title,
+                    type="csv",
+                    text=text,
+                    url=url,
+                    # first part keeps the ids of a sheet read as a single document
+                    part=part if part > 0 else None,
+                )
+                part += 1
+
+    finally:
+        workbook.close()
+
+
+def _get_zip_members(zip_file: ZipFile) -> list[ZipInfo]:
+    """Get archive members that can be extracted, checking archive limits"""
+    members: list[ZipInfo] = [
+        info
+        for info in zip_file.infolist()
+        if not info.is_dir()
+        and not path.basename(info.filename).startswith(".")
+        and info.filename.split(".")[-1] in ALLOWED_FILE_EXTENSIONS
+    ]
+
+    if len(members) > ZIP_MAX_MEMBERS:
+        raise RuntimeError(f"Archive has more than {ZIP_MAX_MEMBERS} files")
+
+    # uncompressed size is enforced by zipfile while reading the members
+    if sum(info.file_size for info in members) > ZIP_MAX_SIZE:
+        raise RuntimeError(f"Archive is larger than {ZIP_MAX_SIZE} bytes")
+
+    return members
+
+
+@make_async
+def _read_zip_text(zip_file: ZipFile, info: ZipInfo) -> str:
+    """Read text file from archive"""
+    with zip_file.open(info) as f:
+        return TextIOWrapper(f, encoding="utf-8", errors="ignore").read()
 
-    for worksheet in workbook:
-        csv_output = StringIO()
-        writer = csv.writer(csv_output)
 
-        for row in worksheet.values:
-            writer.writerow(row)
+@make_async
+def _copy_zip_member(zip_file: ZipFile, info: ZipInfo, file_path: str):
+    """Copy file from archive to disk"""
+    with zip_file.open(info) as source_file, open(file_path, "wb") as target_file:
+        copyfileobj(source_file, target_file, ZIP_COPY_BUFFER)
 
-        result.append(
-            KnowledgeDocument(
+
+async def _extract_from_zip_member(
+    zip_file: ZipFile, info: ZipInfo, url: str
+) -> AsyncIterator[KnowledgeDocument]:
+    """Extract text from archive member"""
+    file_name: str = path.basename(info.filename)
+    extension: str = file_name.split(".")[-1]
+    url = path.join(url, path.dirname(info.filename))
+    logger.debug("_extract_from_zip_member, file=%s", info.filename)
+
+    try:
+        if extension in TEXT_FILE_EXTENSIONS:
+            yield KnowledgeDocument(
                 title=file_name,
-                subtitle=worksheet.title,
-                type="csv",
-                text=csv_output.getvalue(),
-                url=url,
+                type=extension,
+                text=await _read_zip_text(zip_file, info),
+                url=path.join(url, file_name),
             )
-        )
+            return
+
+        # binary formats need random access, so the member is copied to disk
+        async with aiofiles.tempfile.TemporaryDirectory(
+            dir=FILE_STORAGE_PATH
+        ) as directory:
+            file_path: str = path.join(directory, file_name)
+            await _copy_zip_member(zip_file, info, file_path)
 
-    return result
+            async for document in _extract_text(file_name, file_path, url):
+                yield document
+
+    except NotImplementedError:
+        logger.warning(
+            "_extract_from_zip_member, file=%s cannot be processed", info.filename
+        )
 
 
 async def _extract_from_zip(
     file_name: str,
     file_path: str,
     url: str,
-) -> list[KnowledgeDocument]:
-    """Extract text from zip file"""
+) -> AsyncIterator[KnowledgeDocument]:
+    """Extract text from zip file
+
+    Members are read directly from the archive, up to ZIP_WORKERS at once
+    """
     logger.debug(
         "_extract_from_zip, file_name=%s, file_path=%s, url=%s",
         file_name,
         file_path,
         url,
     )
-    result: list[KnowledgeDocument] = []
-
-    async with aiofiles.tempfile.TemporaryDirectory(dir=FILE_STORAGE_PATH) as extracted:
-        with ZipFile(file_path) as zip_file:
-            logger.debug("_extract_from_zip, extracting to=%s", extracted)
-            zip_file.extractall(extracted)
-            ctr: int = 0
-
-            for root, _, file_names in walk(extracted):
-                ctr += 1
-                logger.debug(
-                    "_extract_from_zip, root=%s, file_names=%s", root, file_names
-                )
+    document_count: int = 0
 
-                file_names = filter(
-                    lambda x: not x.startswith(".")
-                    and x.split(".")[-1] in ALLOWED_FILE_EXTENSIONS,
-                    file_names,
-                )
+    with ZipFile(file_path) as zip_file:
+        members: list[ZipInfo] = _get_zip_members(zip_file)
+        logger.debug("_extract_from_zip, members=%s", len(members))
 
-                for inner_file_name in file_names:
-                    logger.debug(
-                        "_extract_from_zip, inner_file_name=%s", inner_file_name
-                    )
+        async for document in merge(
+            (_extract_from_zip_member(zip_file, info, url) for info in members),
+            ZIP_WORKERS,
+            # members are extracted ahead of indexing by at most a document each
+            maxsize=ZIP_WORKERS,
+        ):
+            document_count += 1
+            yield document
 
-                    try:
-                        result += await _extract_text(
-                            inner_file_name,
-                            path.join(root, inner_file_name),
-                            path.join(url, root.replace(extracted, "")),
-                        )
-
-                    except NotImplementedError:
-                        logger.warning(
-                            "_extract_from_zip, file=%s cannot be processed",
-                            inner_file_name,
-                        )
-
-            if len(result) == 0:
-                raise RuntimeError("Archive is empty")
-
-    return result
+    if document_count == 0:
+        raise RuntimeError("Archive is empty")
 
 
 async def _extract_text(
     file_name: str, file_path: str, url: str
-) -> list[KnowledgeDocument]:
+) -> AsyncIterator[KnowledgeDocument]:
     """Extract text from file(s)"""
     # depending on file extension, use different function
     logger.debug(
@@ -205,31 +393,67 @@ async def _extract_text(
     )
     extension: str = file_path.split(".")[-1]
     url = path.join(url, file_name)
+    documents: AsyncIterator[KnowledgeDocument]
 
     match extension:
-        case "txt" | "csv" | "md" | "xml":
-            return await _extract_from_txt(file_name, file_path, url, extension)
+        case _ if extension in TEXT_FILE_EXTENSIONS:
+            documents = _extract_from_txt(file_name, file_path, url, extension)
+        case "xml":
+            documents = _extract_from_xml(file_name, file_path, url)
         case "pdf":
-            return await _extract_from_pdf(file_name, file_path, url)
+            documents = _extract_from_pdf(file_name, file_path, url)
         case "docx":
-            return await _extract_from_docx(file_name, file_path, url)
+            documents = _extract_from_docx(file_name, file_path, url)
         case "xlsx":
-            return await _extract_from_xlsx(file_name, file_path, url)
+            documents = _extract_from_xlsx(file_name, file_path, url)
         case "zip":
-            return await _extract_from_zip(file_name, file_path, url)
-
-    raise NotImplementedError()
-
-
-async def index(source: Source) -> int:
-    """Index source"""
-    logger.info("index, source=%s", source)
-    documents: list[KnowledgeDocument] = await _extract_text(
+            documents = _extract_from_zip(file_name, file_path, url)
+        case _:
+            raise NotImplementedError()
+
+    async for document in documents:
+        yield document
+
+
+async def index(
+    source: Source,
+    configuration: SourceConfiguration,
+    reuse_source_id: Optional[str] = None,
+) -> int:
+    """Index source
+
+    Documents are extracted lazily and flow through chunking, embedding and upsert
+    stages concurrently, so only a bounded number of them is kept in memory. Only
+    changed chunks are embedded, chunks that are gone from the source are deleted.
+    Extracted documents are cached by file hash, so a retry skips extraction.
+    Embeddings of the reused source, indexed from the same file, are not computed
+    again.
+    """
+    logger.info("index, source=%s, configuration=%s", source, configuration)
+    documents: AsyncIterator[KnowledgeDocument] = _extract_text(
         source.title, source.progress.temporary_file_path, ""
     )
 
-    for document in documents:
-        logger.debug("index, document=%s", document)
-        await knowledge_service.create(str(source.id), source.title, document)
+    if extraction_cache.EXTRACTION_CACHE and source.progress.file_hash is not None:
+        version: str = (
+            f"{EXTRACTOR_VERSION}/{XLSX_ROWS_PER_DOCUMENT}/{XML_RECORDS_PER_DOCUMENT}"
+        )
+        documents = extraction_cache.cached(
+            extraction_cache.get_key(source.progress.file_hash, version),
+            source.title,
+            documents,
+        )
 
-    return len(documents)
+    documents = buffered(documents, EXTRACTION_QUEUE_SIZE)
+
+    async with DocumentWriter(DocumentCollection()) as writer:
+        return await knowledge_service.create_many(
+            str(source.id),
+            source.title,
+            documents,
+            writer=writer,
+            chunk_size=configuration.chunk_size,
+            chunk_overlap=configuration.chunk_overlap,
+            incremental=True,
+            reuse_source_id=reuse_source_id,
+        )
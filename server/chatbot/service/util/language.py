@@ -1,6 +1,7 @@
 from logging import getLogger
-from typing import List, Optional
-from spacy import load
+from os import environ
+from typing import Iterator, List, Optional
+from spacy import load, blank
 from spacy.language import Language as SpacyLanguage, Doc as SpacyDoc
 import spacy_fastlang
 
@@ -12,12 +13,31 @@ LANGUAGE_MODELS = {
 # TODO: configure default language
 DEFAULT_LANGUAGE = "en"
 
+# fast - sentence segmentation components only, full - complete pipeline
+SPLIT_MODE = environ.get("SPACY_SPLIT_MODE", "fast").lower()
+# components not needed for sentence segmentation in fast mode
+SPLIT_EXCLUDE = [
+    "parser",
+    "tagger",
+    "morphologizer",
+    "attribute_ruler",
+    "lemmatizer",
+    "ner",
+]
+# number of characters language is detected by
+DETECTION_SAMPLE_SIZE = int(environ.get("SPACY_DETECTION_SAMPLE_SIZE", "2000"))
+# long texts are processed in segments of this many characters, split at line breaks
+SEGMENT_SIZE = int(environ.get("SPACY_SEGMENT_SIZE", "100000"))
+PROCESSES = int(environ.get("SPACY_PROCESSES", "1"))
+
 logger = getLogger(__name__)
 
 
 class Language:
     """Language utils using Spacy"""
     _models: dict[str, SpacyLanguage] = {}
+    _splitters: dict[str, SpacyLanguage] = {}
+    _detector: Optional[SpacyLanguage] = None
 
     @classmethod
     def get_model(cls, language: Optional[str] = None) -> SpacyLanguage:
@@ -32,24 +52,87 @@ class Language:
 
         return cls._models[language]
 
+    @classmethod
+    def get_splitter(cls, language: Optional[str] = None) -> SpacyLanguage:
+        """Get sentence splitting model by language"""
+        if language is None:
+            language = DEFAULT_LANGUAGE
+
+        if SPLIT_MODE == "full":
+            return cls.get_model(language)
+
+        if language not in cls._splitters:
+            logger.info("loading splitter for %s", language)
+            splitter: SpacyLanguage = load(
+                LANGUAGE_MODELS[language], exclude=SPLIT_EXCLUDE
+            )
+
+            if "senter" in splitter.component_names:
+                splitter.enable_pipe("senter")
+            else:
+                splitter.add_pipe("sentencizer")
+
+            # senter has its own tok2vec layer, the shared one feeds excluded
+            # components only
+            if (
+                "tok2vec" in splitter.pipe_names
+                and len(splitter.get_pipe("tok2vec").listening_components) == 0
+            ):
+                splitter.remove_pipe("tok2vec")
+
+            cls._splitters[language] = splitter
+
+        return cls._splitters[language]
+
+    @classmethod
+    def get_detector(cls) -> SpacyLanguage:
+        """Get language detection model"""
+        if cls._detector is None:
+            logger.info("loading detector")
+            cls._detector = blank("xx")
+            cls._detector.add_pipe("language_detector")
+
+        return cls._detector
+
     def _get_model_by_text(self, text: str) -> SpacyLanguage:
         """Get model by text"""
         language: str = self.detect_language(text)
 
         if language == DEFAULT_LANGUAGE or language not in LANGUAGE_MODELS:
-            return Language.get_model()
+            return Language.get_splitter()
 
-        return Language.get_model(language)
+        return Language.get_splitter(language)
 
     def detect_language(self, text: str) -> str:
         """Get language by text sample"""
-        model: SpacyLanguage = Language.get_model()
-        document: SpacyDoc = model(text)
+        model: SpacyLanguage = Language.get_detector()
+        document: SpacyDoc = model(text[:DETECTION_SAMPLE_SIZE])
         language: str = document._.language
 
         return language
 
+    @staticmethod
+    def _get_segments(text: str) -> Iterator[str]:
+        """Split text into segments of at most SEGMENT_SIZE characters"""
+        start: int = 0
+
+        while len(text) - start > SEGMENT_SIZE:
+            end: int = text.rfind("\n", start, start + SEGMENT_SIZE) + 1
+
+            if end <= start:
+                end = start + SEGMENT_SIZE
+
+            yield text[start:end]
+            start = end
+
+        yield text[start:]
+
     def split_sentences(self, text: str) -> List[str]:
         """Split text by sentences"""
         model: SpacyLanguage = self._get_model_by_text(text)
-        return [sentence.text for sentence in model(text).sents]
+        sentences: List[str] = []
+
+        for document in model.pipe(self._get_segments(text), n_process=PROCESSES):
+            sentences += [sentence.text for sentence in document.sents]
+
+        return sentences
@@ -1,5 +1,11 @@
 from .connection import queue
-from .source import index_source
+from .knowledge import rebuild_lexical_index
+from .source import (
+    index_source,
+    delete_source_documents,
+    sweep_orphan_documents,
+    collect_unused_files,
+)
 
 # TODO: make configurable from UI, per-task. Now it's 2 hours
 TIMEOUT = 7200
@@ -17,4 +23,8 @@ __all__ = [
     "queue",
     "enqueue",
     "index_source",
+    "delete_source_documents",
+    "sweep_orphan_documents",
+    "collect_unused_files",
+    "rebuild_lexical_index",
 ]
@@ -0,0 +1,13 @@
+from logging import getLogger
+from saq.types import Context
+
+from chatbot.service import knowledge as service
+
+logger = getLogger(__name__)
+
+
+async def rebuild_lexical_index(ctx: Context):
+    """Index all documents of vector store in lexical index"""
+    logger.debug("rebuild_lexical_index, ctx=%s", ctx)
+    indexed: int = await service.rebuild_lexical_index()
+    logger.info("rebuild_lexical_index, indexed=%s", indexed)
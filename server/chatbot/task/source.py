@@ -23,3 +23,25 @@ async def index_source(ctx: Context, *, source_id: UUID, reindex: Optional[bool]
     logger.debug(
         "index_source, indexing finished, ctx=%s, source_id=%s, reindex=%s",
         ctx, source_id, reindex)
+
+
+async def delete_source_documents(ctx: Context, *, source_id: UUID):
+    """Delete documents of deleted source from vector store"""
+    logger.debug("delete_source_documents, ctx=%s, source_id=%s", ctx, source_id)
+    deleted: int = await service.delete_documents(source_id)
+    logger.debug("delete_source_documents, source_id=%s, deleted=%s",
+                 source_id, deleted)
+
+
+async def sweep_orphan_documents(ctx: Context):
+    """Delete documents of sources that don't exist anymore from vector store"""
+    logger.debug("sweep_orphan_documents, ctx=%s", ctx)
+    deleted: int = await service.sweep_orphan_documents()
+    logger.info("sweep_orphan_documents, deleted=%s", deleted)
+
+
+async def collect_unused_files(ctx: Context):
+    """Remove uploaded files that are not referenced by sources"""
+    logger.debug("collect_unused_files, ctx=%s", ctx)
+    removed: int = await service.collect_unused_files()
+    logger.info("collect_unused_files, removed=%s", removed)
@@ -1,5 +1,15 @@
 import asyncio
 from functools import wraps, partial
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+T = TypeVar("T")
 
 
 def make_async(func):
@@ -11,3 +21,100 @@ def make_async(func):
         pfunc = partial(func, *args, **kwargs)
         return await loop.run_in_executor(executor, pfunc)
     return run
+
+
+_END = object()
+
+
+async def buffered(iterable: AsyncIterable[T], maxsize: int) -> AsyncIterator[T]:
+    """Iterate items produced concurrently by a background task
+
+    The producer runs ahead of the consumer by at most maxsize items, which lets
+    pipeline stages overlap while keeping memory bounded. Producer errors are
+    re-raised in the consumer, and the producer is cancelled when the consumer stops.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    error: Optional[Exception] = None
+
+    async def produce():
+        nonlocal error
+
+        try:
+            async for item in iterable:
+                await queue.put(item)
+
+        except Exception as produce_error:
+            error = produce_error
+
+        await queue.put(_END)
+
+    producer: asyncio.Task = asyncio.create_task(produce())
+
+    try:
+        while (item := await queue.get()) is not _END:
+            yield item
+
+        if error is not None:
+            raise error
+
+    finally:
+        producer.cancel()
+
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+
+
+async def merge(
+    iterables: Iterable[AsyncIterable[T]],
+    concurrency: int,
+    maxsize: Optional[int] = None,
+) -> AsyncIterator[T]:
+    """Iterate items of several iterables, consuming up to concurrency of them at once
+
+    Items are yielded in the order they are produced. Iterables are taken lazily,
+    the first error stops all of them and is re-raised in the consumer. Producers
+    run ahead of the consumer by at most maxsize items, concurrency if not set.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize or concurrency)
+    pending: Iterator[AsyncIterable[T]] = iter(iterables)
+    error: Optional[Exception] = None
+
+    async def consume():
+        nonlocal error
+
+        try:
+            for iterable in pending:
+                async for item in iterable:
+                    await queue.put(item)
+
+        except Exception as consume_error:
+            error = error or consume_error
+
+        await queue.put(_END)
+
+    workers: list[asyncio.Task] = [
+        asyncio.create_task(consume()) for _ in range(concurrency)
+    ]
+    running: int = len(workers)
+
+    try:
+        while running > 0:
+            item = await queue.get()
+
+            if item is _END:
+                running -= 1
+
+                if error is not None:
+                    raise error
+
+                continue
+
+            yield item
+
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """Bounded in-process LRU cache with optional TTL and hit/miss counters"""
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """Constructor"""
+        self.max_size: int = max_size
+        self.ttl: Optional[float] = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get value by key, None if missing or expired"""
+        item: Optional[tuple[float, Any]] = self._items.get(key)
+
+        if item is None or (self.ttl is not None and time.monotonic() > item[0]):
+            if item is not None:
+                del self._items[key]
+
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        """Set value by key, evicting the least recently used item if full"""
+        expires_at: float = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """Remove all items and reset counters"""
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Get cache statistics"""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._items),
+            max_size=self.max_size,
+        )
+
+    def __len__(self) -> int:
+        return len(self._items)
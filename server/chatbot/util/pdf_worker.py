@@ -0,0 +1,61 @@
+import signal
+from logging import getLogger
+from typing import Optional
+
+import pdfplumber
+
+# Functions run in spawned pdf extraction processes. The module imports only
+# pdfplumber, so workers don't load the application packages.
+
+logger = getLogger(__name__)
+
+
+class PageTimeoutError(Exception):
+    """Page extraction took too long"""
+
+
+def _raise_timeout(signum, frame):
+    raise PageTimeoutError()
+
+
+def get_page_count(file_path: str) -> int:
+    """Get number of pages in pdf file"""
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pages(file_path: str, start: int, end: int, timeout: float) -> list[str]:
+    """Extract text of pages [start, end), skipping pages that exceed the timeout
+
+    Runs in a worker process, where the timeout is implemented with SIGALRM
+    """
+    page_texts: list[str] = []
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+    # pdfplumber page numbers are 1-based
+    with pdfplumber.open(file_path, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            page_text: Optional[str] = None
+
+            try:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+                page_text = page.extract_text(x_tolerance=1)
+
+            except PageTimeoutError:
+                logger.warning(
+                    "extract_pages, file_path=%s, page=%s timed out after %ss",
+                    file_path,
+                    page.page_number,
+                    timeout,
+                )
+
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+
+            if page_text is not None:
+                page_texts.append(page_text)
+
+            # release parsed page objects
+            page.close()
+
+    return page_texts
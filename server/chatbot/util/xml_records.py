@@ -0,0 +1,65 @@
+from collections import Counter, defaultdict
+from logging import getLogger
+from typing import IO, Iterator, Optional
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element, iterparse
+
+logger = getLogger(__name__)
+
+
+def find_repeating_node(
+    source: IO, min_repetitions: int = 10, max_events: int = 100000
+) -> Optional[str]:
+    """Find the shallowest tag repeating at least min_repetitions times at the same
+    depth, scanning only the first max_events elements of the document"""
+    tag_counters: defaultdict[int, Counter] = defaultdict(Counter)
+    parents: list[Element] = []
+
+    for i, (event, node) in enumerate(iterparse(source, events=("start", "end"))):
+        if event == "start":
+            tag_counters[len(parents)][node.tag] += 1
+            parents.append(node)
+        else:
+            parents.pop()
+            node.clear()
+
+        if i >= max_events:
+            break
+
+    for depth, tag_counter in sorted(tag_counters.items()):
+        for tag, count in tag_counter.most_common():
+            if count >= min_repetitions:
+                logger.debug("find_repeating_node, tag=%s, count=%s", tag, count)
+                return tag
+
+    return None
+
+
+def iter_records(source: IO, tag: str) -> Iterator[str]:
+    """Iterate serialized nodes with the given tag, clearing parsed nodes so that
+    memory doesn't grow with the document size"""
+    parents: list[Element] = []
+    record_depth: Optional[int] = None
+
+    for event, node in iterparse(source, events=("start", "end")):
+        if event == "start":
+            if record_depth is None and node.tag == tag:
+                record_depth = len(parents)
+
+            parents.append(node)
+            continue
+
+        parents.pop()
+
+        if record_depth is not None and len(parents) > record_depth:
+            # inside a record, keep the node until the record is serialized
+            continue
+
+        if record_depth is not None:
+            yield ElementTree.tostring(node, encoding="unicode")
+            record_depth = None
+
+        node.clear()
+
+        if len(parents) > 0:
+            parents[-1].remove(node)
@@ -21,6 +21,7 @@ from chatbot.controller import (
 )
 from chatbot.knowledge import DocumentCollection
 from chatbot.log import LogConfig
+from chatbot.service.embedding import shutdown_executor
 from chatbot.service.tool import ToolFactory
 
 ORIGINS = [
@@ -63,6 +64,13 @@ async def startup():
     DocumentCollection().create()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Shutdown entry point"""
+    shutdown_executor()
+    DocumentCollection().close()
+
+
 @app.exception_handler(RequestValidationError)
 async def request_validation_error_handler(_: Request, exc: RequestValidationError):
     """Request validation error handler"""
@@ -2,10 +2,28 @@ from logging import config, getLogger
 from os import environ
 from typing import cast, List, Coroutine
 
+from saq import CronJob
+
 from chatbot.knowledge import DocumentCollection
 from chatbot.log import LogConfig
+from chatbot.service import knowledge as knowledge_service
+from chatbot.service.embedding import shutdown_executor
+from chatbot.service.source.pdf import shutdown_executor as shutdown_pdf_executor
 from chatbot.service.tool import ToolFactory
-from chatbot.task import queue, index_source
+from chatbot.task import (
+    queue,
+    index_source,
+    delete_source_documents,
+    sweep_orphan_documents,
+    collect_unused_files,
+    rebuild_lexical_index,
+    enqueue,
+)
+from tools.question_answering import rerank
+
+# daily by default
+ORPHAN_SWEEP_CRON = environ.get("ORPHAN_SWEEP_CRON", "0 3 * * *")
+FILE_GC_CRON = environ.get("FILE_GC_CRON", "30 3 * * *")
 
 config.dictConfig(LogConfig().dict())
 logger = getLogger(__name__)
@@ -16,10 +34,22 @@ async def startup(ctx: dict):
     logger.debug("startup, ctx=%s", ctx)
     DocumentCollection().create()
 
+    if rerank.RERANK_PRELOAD:
+        await rerank.preload()
+
+    if await knowledge_service.is_lexical_index_missing():
+        # the key keeps several workers from rebuilding it at once
+        await enqueue(rebuild_lexical_index, key=rebuild_lexical_index.__name__)
+
 
 async def shutdown(ctx: dict):
     """Shutdown task"""
     logger.debug("shutdown, ctx=%s", ctx)
+    shutdown_executor()
+    shutdown_pdf_executor()
+    rerank.shutdown_executor()
+    knowledge_service.shutdown_chunking_executor()
+    DocumentCollection().close()
 
 
 async def before_process(ctx: dict):
@@ -29,15 +59,31 @@ async def before_process(ctx: dict):
 
 async def after_process(ctx: dict):
     """After process task"""
-    logger.debug("after_process, ctx=%s", ctx)
+    logger.debug(
+        "after_process, ctx=%s, query_cache=%s",
+        ctx,
+        knowledge_service.get_query_cache_stats(),
+    )
 
 
 settings = {
     "queue": queue,
-    "functions": cast(List[Coroutine], [index_source])
+    "functions": cast(
+        List[Coroutine],
+        [
+            index_source,
+            delete_source_documents,
+            sweep_orphan_documents,
+            collect_unused_files,
+            rebuild_lexical_index,
+        ],
+    )
     + list(ToolFactory().get_task_entry_points().values()),
     "concurrency": int(environ.get("BACKGROUND_WORKERS", "4")),
-    "cron_jobs": [],
+    "cron_jobs": [
+        CronJob(sweep_orphan_documents, cron=ORPHAN_SWEEP_CRON),
+        CronJob(collect_unused_files, cron=FILE_GC_CRON),
+    ],
     "startup": startup,
     "shutdown": shutdown,
     "before_process": before_process,
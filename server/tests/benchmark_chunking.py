@@ -0,0 +1,153 @@
+import sys
+import timeit
+from argparse import ArgumentParser
+from logging import getLogger, basicConfig, DEBUG
+from os import path
+from zipfile import ZipFile
+
+import jsonlines
+
+sys.path.append("..")
+from chatbot.service import knowledge as knowledge_service
+from chatbot.service.embedding import E5, BaseEmbeddingModel
+from chatbot.service.knowledge import TokenCounter, CHUNK_GLUE
+
+# ========================================
+# Chunk assembly microbenchmark:
+# * legacy - pack sentences, then add overlaps per chunk by re-splitting neighbours
+# * current - single pass over precomputed sentence offsets
+# ========================================
+
+basicConfig(format="%(levelname)s:%(message)s", level=DEBUG)
+logger = getLogger("benchmark_chunking")
+
+
+class CharacterModel(BaseEmbeddingModel):
+    """Model measuring text length in characters, to run without a tokenizer"""
+
+    async def generate_embedding(self, is_query: bool, text: str) -> list[float]:
+        # not used by the benchmark, embeds text as its length
+        return [float(len(text))]
+
+
+def legacy_assemble_chunks(
+    sentences: list[str], limit: int, overlap: int, counter: TokenCounter
+) -> list[str]:
+    """Chunk assembly as it was implemented before the single pass version"""
+    chunks: list[str] = []
+    chunk_size: int = 0
+    current_chunk: list[str] = []
+
+    for sentence, sentence_size in zip(sentences, counter.count_many(sentences)):
+        if chunk_size + sentence_size > limit:
+            if len(current_chunk) > 0:
+                chunks.append(CHUNK_GLUE.join(current_chunk))
+
+            current_chunk = []
+            chunk_size = 0
+
+        current_chunk.append(sentence)
+        chunk_size += sentence_size
+
+    if len(current_chunk) > 0:
+        chunks.append(CHUNK_GLUE.join(current_chunk))
+
+    def get_overlay(overlay_sentences: list[str], _reverse: bool = False) -> str:
+        overlay = []
+        total_length = 0
+
+        for sentence in reversed(overlay_sentences) if _reverse else overlay_sentences:
+            if sentence == "#_#_#":
+                continue
+
+            sentence_length = counter(sentence)
+
+            if total_length + sentence_length <= overlap:
+                total_length += sentence_length
+                overlay.append(sentence)
+
+        return "\n".join(reversed(overlay) if _reverse else overlay)
+
+    result: list[str] = []
+
+    for i, chunk in enumerate(chunks):
+        if len(chunks) > 2:
+            prev = chunks[i - 1] if i > 0 else chunk
+            _next = chunks[i + 1] if i < len(chunks) - 1 else chunk
+            temp_tail = ["#_#_#"] if prev == chunk else prev.split("\n")
+            temp_head = ["#_#_#"] if _next == chunk else _next.split("\n")
+            chunk = f"{get_overlay(temp_tail, True)} {chunk} {get_overlay(temp_head)}"
+
+        result.append(chunk)
+
+    return result
+
+
+def load_sentences(archive_path: str, dataset_paths: list[str]) -> list[str]:
+    """Load non-empty lines of the bundled documents and datasets"""
+    logger.debug(
+        "load_sentences, archive_path=%s, dataset_paths=%s", archive_path, dataset_paths
+    )
+    sentences: list[str] = []
+
+    if path.exists(archive_path):
+        with ZipFile(archive_path) as zip_file:
+            for name in sorted(zip_file.namelist()):
+                text: str = zip_file.read(name).decode("utf-8", errors="ignore")
+                sentences += [line for line in text.split("\n") if line.strip() != ""]
+
+    for dataset_path in dataset_paths:
+        with jsonlines.open(dataset_path) as reader:
+            sentences += [obj["question"] for obj in reader.iter(skip_invalid=True)]
+
+    return sentences
+
+
+def main():
+    """Main function"""
+    logger.debug("main")
+
+    parser = ArgumentParser()
+    parser.add_argument("--archive", type=str, default="../../Dataset.zip")
+    parser.add_argument(
+        "--dataset-file",
+        type=str,
+        nargs="*",
+        default=[
+            "datasets/dataset-1.jsonl",
+            "datasets/dataset-2.jsonl",
+            "datasets/dataset-3.jsonl",
+            "datasets/dataset-xml.jsonl",
+        ],
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=256)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--tokenizer", action="store_true")
+    args = parser.parse_args()
+
+    sentences: list[str] = load_sentences(args.archive, args.dataset_file) * args.repeat
+    counter: TokenCounter = TokenCounter(E5() if args.tokenizer else CharacterModel())
+
+    # warm up token count cache, so both implementations measure assembly only
+    counter.count_many(sentences)
+    logger.debug("sentences=%s", len(sentences))
+
+    for name, assemble in (
+        ("legacy", legacy_assemble_chunks),
+        ("current", knowledge_service._assemble_chunks),
+    ):
+        chunks: list[str] = assemble(sentences, args.limit, args.overlap, counter)
+        seconds: float = min(
+            timeit.repeat(
+                lambda: assemble(sentences, args.limit, args.overlap, counter),
+                number=1,
+                repeat=args.runs,
+            )
+        )
+        logger.debug("%-8s chunks=%s, seconds=%.4f", name, len(chunks), seconds)
+
+
+if __name__ == "__main__":
+    main()
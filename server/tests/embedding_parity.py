@@ -0,0 +1,85 @@
+import asyncio
+import sys
+from argparse import ArgumentParser
+from logging import getLogger, basicConfig, DEBUG
+
+import jsonlines
+import numpy as np
+
+sys.path.append("..")
+from chatbot.service.embedding import E5, E5Onnx
+
+# ========================================
+# Parity of embedding backends:
+# * cosine similarity between E5 (torch) and E5Onnx embeddings of the same texts
+# ========================================
+# Run from this directory with both backends installed, after changing the ONNX
+# export or upgrading onnxruntime, transformers or the model:
+#   python embedding_parity.py [--export] [--min-similarity 0.99]
+# --export writes the ONNX model to E5_ONNX_MODEL_PATH first. Exits with status 1
+# when a text is below --min-similarity, 0.99 is a margin for fp32 ONNX; use a
+# lower one with E5_ONNX_QUANTIZE.
+# ========================================
+
+basicConfig(format="%(levelname)s:%(message)s", level=DEBUG)
+logger = getLogger("embedding_parity")
+
+
+def load_texts(file_path: str) -> list[str]:
+    """Load questions from dataset file"""
+    logger.debug("load_texts, file_path=%s", file_path)
+
+    with jsonlines.open(file_path) as reader:
+        return [obj["question"] for obj in reader.iter(skip_invalid=True)]
+
+
+async def compare(texts: list[str], is_query: bool) -> np.ndarray:
+    """Get cosine similarities between embeddings of both backends"""
+    logger.debug("compare, texts=%s, is_query=%s", len(texts), is_query)
+
+    expected: np.ndarray = np.array(await E5().generate_embeddings(is_query, texts))
+    actual: np.ndarray = np.array(await E5Onnx().generate_embeddings(is_query, texts))
+
+    # both backends return normalized embeddings
+    return (expected * actual).sum(axis=1)
+
+
+async def main():
+    """Main function"""
+    logger.debug("main")
+
+    parser = ArgumentParser()
+    parser.add_argument("--dataset-file", type=str, default="datasets/dataset-2.jsonl")
+    parser.add_argument("--min-similarity", type=float, default=0.99)
+    parser.add_argument("--export", action="store_true")
+    args = parser.parse_args()
+
+    if args.export:
+        E5Onnx.export()
+
+    texts: list[str] = load_texts(args.dataset_file)
+    passed: bool = True
+
+    for is_query in (True, False):
+        similarities: np.ndarray = await compare(texts, is_query)
+        logger.debug(
+            "is_query=%s, min=%.6f, mean=%.6f",
+            is_query,
+            similarities.min(),
+            similarities.mean(),
+        )
+
+        if similarities.min() < args.min_similarity:
+            logger.error(
+                "is_query=%s, similarity below %s for: %s",
+                is_query,
+                args.min_similarity,
+                texts[int(similarities.argmin())],
+            )
+            passed = False
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
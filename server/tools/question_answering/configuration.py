@@ -9,3 +9,11 @@ class Configuration(ToolConfiguration):
     prompt_answer: str
     prompt_compress_question: str
     answer_negative: str
+    # rerank a wider set of candidates with a cross-encoder before building a prompt
+    rerank: bool = False
+    rerank_candidates: int = 50
+    # empty uses RERANK_MODEL_PATH
+    rerank_model_path: str = ""
+    # seconds, unscored candidates keep vector search order; scoring 50 candidates
+    # with bge-reranker-v2-m3 takes several seconds on CPU, use a GPU for less
+    rerank_timeout: float = 10.0
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import time
+from asyncio import Future
+from concurrent.futures import Executor, ThreadPoolExecutor
+from logging import getLogger
+from os import environ, getpid
+from threading import Lock
+from typing import List, Optional
+
+from sentence_transformers import CrossEncoder
+
+from chatbot.dto import KnowledgeResult
+from chatbot.util.cache import LRUCache
+
+RERANK_MODEL_PATH = environ.get(
+    "RERANK_MODEL_PATH", "/media/love/ml/bge-reranker-v2-m3"
+)
+# number of (question, source) pairs scored at once
+RERANK_BATCH_SIZE = int(environ.get("RERANK_BATCH_SIZE", "16"))
+RERANK_CACHE_MAX_ITEMS = int(environ.get("RERANK_CACHE_MAX_ITEMS", "10000"))
+RERANK_CACHE_TTL = float(environ.get("RERANK_CACHE_TTL", "3600"))
+RERANK_DEVICE = environ.get("RERANK_DEVICE", "cpu")
+RERANK_WORKERS = int(environ.get("RERANK_WORKERS", "1"))
+# load RERANK_MODEL_PATH when the worker starts, so that the first question
+# doesn't wait for it
+RERANK_PRELOAD = environ.get("RERANK_PRELOAD", "false").lower() == "true"
+
+logger = getLogger(__name__)
+
+# in-process cache of scores, keyed by hash of (model path, question, text)
+_score_cache: LRUCache = LRUCache(RERANK_CACHE_MAX_ITEMS, RERANK_CACHE_TTL)
+_executor: Optional[Executor] = None
+_executor_pid: Optional[int] = None
+
+
+class Reranker:
+    """Cross-encoder models, loaded once per process and path"""
+
+    _models: dict[str, CrossEncoder] = {}
+    _lock: Lock = Lock()
+
+    @classmethod
+    def get_model(cls, model_path: str) -> CrossEncoder:
+        """Get or load model"""
+        with cls._lock:
+            if model_path not in cls._models:
+                logger.info("loading model, model_path=%s", model_path)
+                cls._models[model_path] = CrossEncoder(model_path, device=RERANK_DEVICE)
+
+        return cls._models[model_path]
+
+    @classmethod
+    def is_loaded(cls, model_path: str) -> bool:
+        """Check if model is loaded"""
+        return model_path in cls._models
+
+
+def get_executor() -> Executor:
+    """Get rerank executor, created once per process
+
+    Scoring runs apart from the embedding executor, so that it doesn't hold up
+    embedding of questions and documents
+    """
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != getpid():
+        logger.info("get_executor, workers=%s", RERANK_WORKERS)
+        _executor = ThreadPoolExecutor(
+            max_workers=RERANK_WORKERS, thread_name_prefix="rerank"
+        )
+        _executor_pid = getpid()
+
+    return _executor
+
+
+def shutdown_executor():
+    """Shutdown rerank executor"""
+    global _executor
+
+    if _executor is not None and _executor_pid == getpid():
+        logger.info("shutdown_executor")
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+    _executor = None
+
+
+async def preload(model_path: Optional[str] = None):
+    """Load model in the background of the rerank executor"""
+    model_path = model_path or RERANK_MODEL_PATH
+    await asyncio.get_running_loop().run_in_executor(
+        get_executor(), Reranker.get_model, model_path
+    )
+
+
+def _predict(model_path: str, pairs: List[tuple[str, str]]) -> List[float]:
+    """Score pairs with the model loaded in the current process"""
+    model: CrossEncoder = Reranker.get_model(model_path)
+
+    return model.predict(
+        pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False
+    ).tolist()
+
+
+def _cache_scores(keys: List[str], future: Future):
+    """Cache scores of a finished batch, also when rerank stopped waiting for it"""
+    if not future.cancelled() and future.exception() is None:
+        for key, score in zip(keys, future.result()):
+            _score_cache.set(key, score)
+
+
+def _get_key(model_path: str, question: str, text: str) -> str:
+    return hashlib.sha256(
+        "\0".join([model_path, question, text]).encode("utf-8")
+    ).hexdigest()
+
+
+async def rerank(
+    question: str,
+    sources: List[KnowledgeResult],
+    limit: int,
+    model_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> List[KnowledgeResult]:
+    """Order sources by cross-encoder score and keep the best ones
+
+    Scoring stops when the timeout is exceeded, sources that are not scored by then
+    follow the scored ones in their original order. Batches finishing late are
+    still cached. Loading the model doesn't count toward the timeout.
+    """
+    logger.debug(
+        "rerank, question=%s, sources=%s, limit=%s, model_path=%s, timeout=%s",
+        question,
+        len(sources),
+        limit,
+        model_path,
+        timeout,
+    )
+    model_path = model_path or RERANK_MODEL_PATH
+    keys: List[str] = [_get_key(model_path, question, s.text) for s in sources]
+    scores: List[Optional[float]] = [_score_cache.get(key) for key in keys]
+    missing: List[int] = [i for i, score in enumerate(scores) if score is None]
+
+    if len(missing) > 0 and not Reranker.is_loaded(model_path):
+        await preload(model_path)
+
+    deadline: float = time.monotonic() + timeout if timeout else float("inf")
+
+    for start in range(0, len(missing), RERANK_BATCH_SIZE):
+        batch: List[int] = missing[start : start + RERANK_BATCH_SIZE]
+        remaining: float = deadline - time.monotonic()
+
+        if remaining <= 0:
+            logger.warning("rerank, timeout, unscored sources=%s", len(missing) - start)
+            break
+
+        future: Future = asyncio.get_running_loop().run_in_executor(
+            get_executor(),
+            _predict,
+            model_path,
+            [(question, sources[i].text) for i in batch],
+        )
+        future.add_done_callback(
+            lambda f, batch_keys=[keys[i] for i in batch]: _cache_scores(batch_keys, f)
+        )
+        # the future is not cancelled on timeout, its scores are cached when done
+        await asyncio.wait(
+            {future}, timeout=None if remaining == float("inf") else remaining
+        )
+
+        if not future.done():
+            logger.warning("rerank, timeout, unscored sources=%s", len(missing) - start)
+            break
+
+        for i, score in zip(batch, future.result()):
+            scores[i] = score
+
+    logger.debug("rerank, cache=%s", _score_cache.stats)
+
+    scored: List[int] = sorted(
+        (i for i, score in enumerate(scores) if score is not None),
+        key=lambda i: scores[i],
+        reverse=True,
+    )
+    unscored: List[int] = [i for i, score in enumerate(scores) if score is None]
+
+    return [sources[i] for i in (scored + unscored)[:limit]]
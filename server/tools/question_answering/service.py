@@ -31,6 +31,7 @@ from chatbot.service.tool.prompt import (
     check_prompt_fits_context_window,
 )
 from .configuration import Configuration
+from .rerank import rerank
 
 SUMMARY_GLUE = "\n----------\n"
 
@@ -45,9 +46,25 @@ async def _search_sources(
         "_search_sources, configuration=%s, question=%s", configuration, question
     )
 
-    result: List[KnowledgeResult] = await knowledge_service.search(
-        question, limit=configuration.max_results
-    )
+    result: List[KnowledgeResult]
+
+    if configuration.rerank:
+        candidates: List[KnowledgeResult] = await knowledge_service.search(
+            question,
+            limit=max(configuration.rerank_candidates, configuration.max_results),
+        )
+        result = await rerank(
+            question,
+            candidates,
+            configuration.max_results,
+            configuration.rerank_model_path,
+            configuration.rerank_timeout,
+        )
+    else:
+        result = await knowledge_service.search(
+            question, limit=configuration.max_results
+        )
+
     logger.debug("_search_sources, matched sources=%s", result)
 
     return result